@@ -1,29 +1,67 @@
+from app.core import startup
+
+startup.start_run()
+
+import os
+import tempfile
+
 import streamlit as st
 import pandas as pd
 
 from app.core.warehouse import (
     init_db,
-    register_new_dataset,
+    create_dataset_from_df,
     create_version_from_df,
     list_datasets,
     list_versions,
     set_active_version,
     get_active_table,
+    get_version_metadata,
     sql,
+    sql_scalar,
+    sql_page,
+    count_rows,
+    export_query,
+    table_columns,
 )
-from app.core.profiling import basic_profile
-from app.core.transforms import DEFAULT_RECIPE, FEATURE_RECIPE, apply_recipe, recipe_to_json
+from app.core.batch import run_batch
+from app.core.cubes import cube_stats
+from app.core.diff import diff_versions
+from app.core.profiling import NUMERIC_TYPES, profile_version
+from app.core.samples import load_sample
+from app.core.transforms import DEFAULT_RECIPE, FEATURE_RECIPE, apply_recipe, detect_date_formats, recipe_to_json
 from app.core.quality import quality_report
+from app.core.quality_rules import RULE_TYPES, add_rule, delete_rule, evaluate_version, list_rules
 from app.core.projects import create_project, list_projects, update_project
 from app.core.reports import save_report, list_reports, get_report
 from app.core.sql_safety import is_sql_safe, enforce_limit
-from app.agent.openai_agent import generate_sql_and_answer
+from app.agent.openai_agent import generate_sql_and_answer, sample_csv_for
+from app.agent import sql_cache
 
+startup.mark("imports")
 
 st.set_page_config(page_title="AI Data Copilot", layout="wide")
 st.title("AI Data Copilot — Launchable V1")
 
+PAGE_SIZE = 500
+
+
+def show_paginated(query: str, key: str) -> pd.DataFrame:
+    """
+    Render a query one page at a time (only the visible page is fetched).
+    Returns the page shown.
+    """
+    total = count_rows(query)
+    pages = max((total - 1) // PAGE_SIZE + 1, 1)
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages}, {total:,} rows)", 1, pages, 1, key=key)
+    page_df = sql_page(query, page - 1, PAGE_SIZE)
+    st.dataframe(page_df, width="stretch")
+    return page_df
+
 init_db()
+startup.mark("init_db")
 
 # -----------------------------
 # SIDEBAR: DATASETS
@@ -40,6 +78,7 @@ if not ds_df.empty:
     )
 else:
     st.sidebar.info("No datasets yet. Upload one.")
+startup.mark("sidebar")
 
 # -----------------------------
 # 1) UPLOAD
@@ -56,10 +95,16 @@ if uploaded:
         else:
             df = pd.read_excel(uploaded)
 
-        dataset_id = register_new_dataset(name=name)
-        create_version_from_df(dataset_id, df, source_filename=uploaded.name, recipe_json="[]")
+        dataset_id, version_id = create_dataset_from_df(name, df, source_filename=uploaded.name, recipe_json="[]")
         st.success("Imported! Now select it in the left sidebar.")
 
+        meta = get_version_metadata(version_id)
+        if meta:
+            st.caption(
+                f"Memory: {meta['memory_before_bytes'] / 1e6:.1f} MB -> {meta['memory_after_bytes'] / 1e6:.1f} MB "
+                "(low-cardinality text stored as ENUM)"
+            )
+
 st.divider()
 
 # -----------------------------
@@ -80,9 +125,42 @@ if selected_dataset_id:
         )
         selected_table = set_active_version(selected_dataset_id, chosen_version_id)
 
-    # Load preview and full
-    preview = sql(f"SELECT * FROM {selected_table} LIMIT 200")
-    df_full = sql(f"SELECT * FROM {selected_table}")
+        if len(versions) > 1:
+            with st.expander("Compare versions"):
+                vids = versions["version_id"].tolist()
+                c1, c2 = st.columns(2)
+                with c1:
+                    diff_a = st.selectbox("From version", vids, index=1, key="diff_a")
+                with c2:
+                    diff_b = st.selectbox("To version", vids, index=0, key="diff_b")
+                diff_key = st.text_input("Key columns (comma-separated, optional)", key="diff_key")
+                if st.button("Compare"):
+                    keys = [k.strip() for k in diff_key.split(",") if k.strip()] or None
+                    try:
+                        d = diff_versions(int(diff_a), int(diff_b), key_columns=keys)
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        r = d["rows"]
+                        st.write(
+                            f"Rows: {d['row_count_a']:,} -> {d['row_count_b']:,} "
+                            f"(+{r['rows_added']} / -{r['rows_removed']} by {r['basis']}"
+                            + (f", {r['rows_changed']} changed" if "rows_changed" in r else "")
+                            + ")"
+                        )
+                        st.json(d["schema"])
+                        drift = pd.DataFrame(d["column_drift"])
+                        if not drift.empty:
+                            st.dataframe(drift[drift["changed"]], width="stretch")
+
+    # Preview comes from the memory-mapped sample store. The full table is only
+    # read into pandas by actions that need every row (quality report, recipes).
+    sample = load_sample(selected_table)
+    preview = sample.head(200)
+    col_types = table_columns(selected_table)
+    columns = [c for c, _ in col_types]
+    full_rows = int(sql_scalar(f"SELECT COUNT(*) FROM {selected_table}"))
+    startup.mark("load data")
 
     tabs = st.tabs(["Preview", "Profile", "Quality", "Transform", "Quick Analysis", "AI Chat", "Projects & Reports"])
 
@@ -93,19 +171,40 @@ if selected_dataset_id:
         st.header("Preview")
         st.dataframe(preview, width="stretch")
 
+        st.subheader("Export this version")
+        fmt = st.selectbox("Format", [".csv", ".parquet", ".xlsx"], key="export_fmt")
+        if st.button("Prepare export"):
+            # DuckDB writes straight to a temp file; rows never pass through pandas.
+            # The file is handed to the download button in this run only and then
+            # deleted, so later reruns don't re-read it or offer it for another table.
+            fd, path = tempfile.mkstemp(suffix=fmt)
+            os.close(fd)
+            try:
+                export_query(f"SELECT * FROM {selected_table}", path)
+                with open(path, "rb") as fh:
+                    st.download_button(
+                        f"Download {selected_table}{fmt}",
+                        data=fh,
+                        file_name=f"{selected_table}{fmt}",
+                    )
+            except ValueError as e:
+                st.error(str(e))
+            finally:
+                os.remove(path)
+
     # -----------------------------
     # Profile
     # -----------------------------
     with tabs[1]:
         st.header("Profile (sample)")
-        prof = basic_profile(preview)
+        prof = profile_version(selected_table)
         c1, c2, c3 = st.columns(3)
         with c1:
             st.metric("Rows (sample)", prof["rows"])
         with c2:
             st.metric("Columns", prof["cols"])
         with c3:
-            st.metric("Full Rows", df_full.shape[0])
+            st.metric("Full Rows", full_rows)
 
         c1, c2 = st.columns(2)
         with c1:
@@ -115,24 +214,93 @@ if selected_dataset_id:
             st.subheader("Dtypes (sample)")
             st.json(prof["dtypes"])
 
+        meta = get_version_metadata(chosen_version_id) if not versions.empty else None
+        if meta:
+            st.subheader("Storage (warehouse)")
+            st.write(
+                f"Memory on ingest: {meta['memory_before_bytes'] / 1e6:.1f} MB -> "
+                f"{meta['memory_after_bytes'] / 1e6:.1f} MB"
+            )
+            st.json(meta["physical_types"])
+
     # -----------------------------
     # Quality
     # -----------------------------
     with tabs[2]:
         st.header("Data Quality Checks")
-        qr = quality_report(df_full)
-
-        st.write(f"Rows: {qr['rows']} | Columns: {qr['cols']}")
-        st.write(f"Duplicate rows: {qr['duplicate_rows']}")
+        if st.button(f"Run quality checks (loads all {full_rows:,} rows)"):
+            # kept in session so other interactions don't re-read the table
+            st.session_state["quality_report"] = {
+                "table": selected_table,
+                "report": quality_report(sql(f"SELECT * FROM {selected_table}")),
+            }
+
+        saved_qr = st.session_state.get("quality_report")
+        if saved_qr and saved_qr["table"] == selected_table:
+            qr = saved_qr["report"]
+            st.write(f"Rows: {qr['rows']} | Columns: {qr['cols']}")
+            st.write(f"Duplicate rows: {qr['duplicate_rows']}")
+
+            st.subheader("Missing (top 15 by missing %)")
+            miss_df = pd.DataFrame(
+                [{"column": k, **v} for k, v in qr["missing"].items()]
+            ).sort_values("missing_pct", ascending=False).head(15)
+            st.dataframe(miss_df, width="stretch")
+
+            st.subheader("Outliers (IQR scan — top 10 numeric cols)")
+            st.json(qr["outliers_iqr_top10_numeric"])
 
-        st.subheader("Missing (top 15 by missing %)")
-        miss_df = pd.DataFrame(
-            [{"column": k, **v} for k, v in qr["missing"].items()]
-        ).sort_values("missing_pct", ascending=False).head(15)
-        st.dataframe(miss_df, width="stretch")
+        st.divider()
+        st.subheader("Quality rules (this dataset)")
 
-        st.subheader("Outliers (IQR scan — top 10 numeric cols)")
-        st.json(qr["outliers_iqr_top10_numeric"])
+        rules_df = list_rules(selected_dataset_id)
+        if rules_df.empty:
+            st.info("No rules yet. Add one below.")
+        else:
+            st.dataframe(rules_df, width="stretch")
+            del_id = st.selectbox("Delete rule", [None] + rules_df["rule_id"].tolist())
+            if del_id is not None and st.button("Delete selected rule"):
+                delete_rule(int(del_id))
+                st.success("Rule deleted.")
+
+        with st.expander("Add rule"):
+            rule_type = st.selectbox("Rule type", RULE_TYPES)
+            rule_col = st.selectbox("Column", columns, key="rule_col")
+            params = {}
+            if rule_type == "range":
+                lo = st.text_input("Min (blank = none)")
+                hi = st.text_input("Max (blank = none)")
+                # parsed when the rule is added, so a half-typed number isn't an error on every rerun
+                params = {"min": lo.strip() or None, "max": hi.strip() or None}
+            elif rule_type == "regex":
+                params = {"pattern": st.text_input("Pattern (e.g. ^[A-Z]{2}$)")}
+            elif rule_type == "allowed_set":
+                allowed = st.text_input("Allowed values (comma-separated)")
+                params = {"values": [v.strip() for v in allowed.split(",") if v.strip()]}
+            elif rule_type == "referential":
+                params = {
+                    "version_id": st.number_input("Reference version_id", min_value=1, step=1),
+                    "column": st.text_input("Reference column (blank = same name)") or None,
+                }
+            elif rule_type == "freshness":
+                params = {"max_age_days": st.number_input("Max age (days)", min_value=0, value=1, step=1)}
+            if st.button("Add rule"):
+                try:
+                    if rule_type == "range":
+                        params = {k: None if v is None else float(v) for k, v in params.items()}
+                    add_rule(selected_dataset_id, rule_type, rule_col, params)
+                    st.success("Rule added.")
+                except ValueError as e:
+                    st.error(str(e))
+
+        if not rules_df.empty and st.button("Evaluate rules on this version"):
+            try:
+                ev = evaluate_version(selected_dataset_id, int(chosen_version_id))
+            except Exception as e:
+                st.error(f"Rule evaluation failed: {e}")
+            else:
+                st.caption("Cached result (rules and data unchanged)." if ev["cached"] else "Evaluated in one scan.")
+                st.dataframe(pd.DataFrame(ev["results"]), width="stretch")
 
     # -----------------------------
     # Transform
@@ -144,7 +312,7 @@ if selected_dataset_id:
 
         with c1:
             if st.button("Apply DEFAULT cleaning recipe"):
-                cleaned = apply_recipe(df_full, DEFAULT_RECIPE)
+                cleaned = apply_recipe(sql(f"SELECT * FROM {selected_table}"), DEFAULT_RECIPE)
                 create_version_from_df(
                     selected_dataset_id,
                     cleaned,
@@ -155,7 +323,7 @@ if selected_dataset_id:
 
         with c2:
             if st.button("Create FEATURE version"):
-                featured = apply_recipe(df_full, FEATURE_RECIPE)
+                featured = apply_recipe(sql(f"SELECT * FROM {selected_table}"), FEATURE_RECIPE)
                 create_version_from_df(
                     selected_dataset_id,
                     featured,
@@ -166,53 +334,86 @@ if selected_dataset_id:
 
         st.info("Tip: after creating a version, pick the latest version_id in the dropdown above.")
 
+        st.subheader("Batch: DEFAULT cleaning for several datasets")
+        batch_ids = st.multiselect(
+            "Datasets",
+            ds_df["dataset_id"].tolist(),
+            format_func=lambda x: f"{ds_df.set_index('dataset_id').loc[x,'name']} (id={x})",
+        )
+        if st.button("Run batch cleaning") and batch_ids:
+            try:
+                report = run_batch(DEFAULT_RECIPE, dataset_ids=batch_ids)
+            except Exception as e:
+                st.error(f"Batch failed: {e}")
+            else:
+                st.success(
+                    f"{len(report['items'])} versions, {report['rows']:,} rows in {report['seconds']}s "
+                    f"({report['rows_per_sec'] or 0:,} rows/s, {report['schemas']} schema(s))"
+                )
+                st.dataframe(pd.DataFrame(report["items"]), width="stretch")
+                for item in report["failed"]:
+                    st.error(f"{item['source']}: {item['error']}")
+
     # -----------------------------
     # Quick Analysis
     # -----------------------------
     with tabs[4]:
         st.header("Quick Analysis (Universal)")
 
-        st.write(f"Rows: {df_full.shape[0]} | Columns: {df_full.shape[1]}")
-        st.dataframe(df_full.head(50), width="stretch")
+        st.write(f"Rows: {full_rows} | Columns: {len(columns)}")
+        st.dataframe(sample.head(50), width="stretch")
 
-        numeric_cols = df_full.select_dtypes(include="number").columns.tolist()
-        categorical_cols = df_full.select_dtypes(include="object").columns.tolist()
+        numeric_cols = [c for c, t in col_types if t in NUMERIC_TYPES or t.startswith("DECIMAL")]
+        categorical_cols = [c for c, t in col_types if t == "VARCHAR" or t.startswith("ENUM")]
+        date_types = {c for c, t in col_types if t == "DATE" or t.startswith("TIMESTAMP")}
 
+        # Group-bys go through warehouse.sql so they are served from the
+        # version's pre-built cubes when the column is low-cardinality.
         st.subheader("Numeric")
         if numeric_cols:
             num_col = st.selectbox("Select numeric column", numeric_cols)
-            st.bar_chart(df_full[num_col].value_counts().sort_index())
+            counts = sql(
+                f'SELECT "{num_col}" AS value, COUNT(*) AS n FROM {selected_table} GROUP BY "{num_col}" ORDER BY value'
+            ).dropna(subset=["value"])
+            st.bar_chart(counts.set_index("value")["n"])
         else:
             st.info("No numeric columns found.")
 
         st.subheader("Categorical")
         if categorical_cols:
             cat_col = st.selectbox("Select categorical column", categorical_cols)
-            vc = df_full[cat_col].value_counts().head(20)
-            st.bar_chart(vc)
+            vc = sql(
+                f'SELECT "{cat_col}" AS value, COUNT(*) AS n FROM {selected_table} GROUP BY "{cat_col}" ORDER BY n DESC LIMIT 21'
+            ).dropna(subset=["value"]).head(20)
+            st.bar_chart(vc.set_index("value")["n"])
         else:
             st.info("No categorical columns found.")
 
         st.subheader("Time Trend (safe detection)")
-        date_cols = []
-        df_time = df_full.copy()
-        for col in df_time.columns:
-            name = str(col).lower()
-            if "date" in name or "time" in name:
-                parsed = pd.to_datetime(df_time[col], errors="coerce")
-                if parsed.notna().mean() >= 0.5:
-                    df_time[col] = parsed
-                    date_cols.append(col)
+        # date-named text columns count if at least half of the sampled values parse
+        text_formats = {c: fmt for c, fmt in detect_date_formats(sample).items() if c not in date_types}
+        date_cols = [c for c in columns if c in date_types or c in text_formats]
 
         if date_cols:
             date_col = st.selectbox("Select date column", date_cols)
-            temp = df_time.dropna(subset=[date_col]).copy()
-            temp["year"] = temp[date_col].dt.year
-            trend = temp.groupby("year").size()
-            st.line_chart(trend)
+            if date_col in date_types:
+                trend = sql(
+                    f'SELECT year("{date_col}") AS year, COUNT(*) AS n FROM {selected_table} GROUP BY year("{date_col}") ORDER BY year'
+                )
+            else:
+                # parse with the format detected on the sample; counts come from the full table
+                text = f'CAST("{date_col}" AS VARCHAR)'
+                fmt = text_formats[date_col]
+                parsed = f"try_strptime({text}, '{fmt}')" if fmt and "'" not in fmt else f"TRY_CAST({text} AS TIMESTAMP)"
+                trend = sql(f"SELECT year({parsed}) AS year, COUNT(*) AS n FROM {selected_table} GROUP BY 1 ORDER BY 1")
+            st.line_chart(trend.dropna(subset=["year"]).set_index("year")["n"])
         else:
             st.info("No valid date columns detected (by name + sample parsing).")
 
+        stats = cube_stats()
+        if stats["hit_rate"] is not None:
+            st.caption(f"Aggregate cubes: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
     # -----------------------------
     # AI Chat
     # -----------------------------
@@ -224,17 +425,32 @@ if selected_dataset_id:
         prompt = st.text_area("Ask a question about this dataset", height=120)
 
         if st.button("Run AI Chat"):
-            sample_df = df_full.head(80)
-            sample_csv = sample_df.to_csv(index=False)
-
-            plan = generate_sql_and_answer(
-                prompt=prompt,
-                table_name=selected_table,
-                columns=list(df_full.columns),
-                sample_csv=sample_csv,
-            )
+            plan = sql_cache.lookup(prompt, selected_table, columns)
+            if plan is None:
+                plan = generate_sql_and_answer(
+                    prompt=prompt,
+                    table_name=selected_table,
+                    columns=columns,
+                    sample_csv=sample_csv_for(selected_table),
+                )
+            # kept in session so paging through the result doesn't lose it
+            st.session_state["ai_chat"] = {
+                "table": selected_table,
+                "prompt": prompt,
+                "plan": plan,
+                "stored": bool(plan.get("cached")),
+            }
+
+        chat = st.session_state.get("ai_chat")
+        if chat and chat["table"] == selected_table:
+            plan = chat["plan"]
 
             st.subheader("Answer")
+            if plan.get("cached"):
+                st.caption(
+                    f"Reused the SQL saved for \"{plan['cached_question']}\" "
+                    f"(similarity {plan['similarity']:.2f}); the result below is from this version."
+                )
             st.write(plan["answer"])
 
             if plan.get("sql"):
@@ -246,9 +462,11 @@ if selected_dataset_id:
                     st.subheader("SQL (safe)")
                     st.code(safe_sql, language="sql")
 
-                    result_df = sql(safe_sql)
                     st.subheader("Result")
-                    st.dataframe(result_df, width="stretch")
+                    result_df = show_paginated(safe_sql, key="ai_result_page")
+                    if not chat["stored"]:
+                        sql_cache.store(chat["prompt"], selected_table, columns, plan)
+                        chat["stored"] = True
 
                     chart = plan.get("chart")
                     if isinstance(chart, dict):
@@ -312,8 +530,8 @@ if selected_dataset_id:
 ## Dataset
 - dataset_id: {selected_dataset_id}
 - table: {selected_table}
-- rows: {df_full.shape[0]}
-- cols: {df_full.shape[1]}
+- rows: {full_rows}
+- cols: {len(columns)}
 
 ## Notes
 - Add your findings here.
@@ -342,3 +560,13 @@ if selected_dataset_id:
                         file_name=f"report_{rid}.md",
                         mime="text/markdown",
                     )
+
+# -----------------------------
+# Startup / rerun timing
+# -----------------------------
+startup.mark("render")
+timing = startup.report()
+with st.sidebar.expander(f"Timing ({timing['run']}: {timing['total_ms']:.0f} ms)"):
+    if timing["over_budget"]:
+        st.warning(f"Over the {timing['budget_ms']} ms budget.")
+    st.json(timing["phases_ms"])
@@ -1,11 +1,37 @@
 import os
 import json
-from dotenv import load_dotenv
 
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
+
+def _openai_class():
+    """
+    The OpenAI SDK is slow to import and optional, so load it on first use.
+    """
+    try:
+        from openai import OpenAI
+    except Exception:
+        return None
+    return OpenAI
+
+
+def _load_env():
+    """
+    Read a local .env if python-dotenv is installed; otherwise the key
+    has to come from the process environment.
+    """
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        return
+    load_dotenv()
+
+
+def sample_csv_for(table_name: str, rows: int = 80) -> str:
+    """
+    Prompt context: first rows of the version's stored sample as CSV.
+    """
+    from app.core.samples import load_sample
+
+    return load_sample(table_name).head(rows).to_csv(index=False)
 
 
 def generate_sql_and_answer(prompt: str, table_name: str, columns: list[str], sample_csv: str) -> dict:
@@ -14,8 +40,9 @@ def generate_sql_and_answer(prompt: str, table_name: str, columns: list[str], sa
       { "answer": str, "sql": str|None, "chart": dict|None, "error": str|None }
     Never raises -> UI should not crash.
     """
-    load_dotenv()
+    _load_env()
     api_key = os.getenv("OPENAI_API_KEY")
+    OpenAI = _openai_class() if api_key else None
 
     if not api_key or not OpenAI:
         return {
@@ -0,0 +1,385 @@
+"""
+Persistent cache of natural-language question -> validated SQL.
+
+Entries live in the warehouse (nl_sql_cache) and are keyed on the dataset
+schema (its column names), so a question asked about any version with the
+same columns can reuse the SQL. Paraphrases are matched with a small local
+embedding: hashed word + character-trigram features, cosine similarity,
+searched with an in-process index. No network or model download needed.
+
+Similarity alone can't tell "status shipped" from "status not shipped" or
+"top 5" from "top 10", so before reuse both questions must also agree
+exactly on negations, numbers and the column names they mention.
+Only the SQL and chart spec are reused; the answer text described another
+version's data. evaluate() scores the matcher fully offline
+(`python -m app.cli cache-eval`): EVAL_PAIRS were used to tune it,
+HOLDOUT_PAIRS were not and give the out-of-sample check.
+"""
+import hashlib
+import json
+import math
+import re
+from datetime import datetime
+
+from app.core.sql_safety import is_sql_safe
+from app.core.warehouse import _conn, _new_id
+
+DIM = 2048
+MIN_SIMILARITY = 0.7  # tuned on EVAL_PAIRS, checked on HOLDOUT_PAIRS, see evaluate()
+TABLE_PLACEHOLDER = "{table}"
+REUSED_ANSWER = "Reused saved query."
+
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "by", "per", "to", "and", "is", "are", "was", "were",
+    "what", "whats", "which", "show", "me", "give", "list", "tell", "please", "can", "you", "i", "s",
+    "each", "every", "all", "how", "with", "do", "does", "we", "our", "have", "has", "had",
+    "where", "whose", "that", "from", "at", "there", "it", "its", "be", "been", "find", "get",
+}
+
+# query phrasing that doesn't change the SQL; any other word outside the
+# schema/stopwords/qualifiers is treated as a literal (a filter value) and must match
+QUERY_WORDS = {
+    "group", "grouped", "grouping", "breakdown", "broken", "down", "split", "across",
+    "trend", "trends", "value", "values", "amount", "row", "rows", "record", "records", "result", "results",
+    "table", "data", "dataset", "chart", "plot", "graph", "see", "compare", "order", "sorted", "sort", "rank",
+    "ranked", "overall",
+}
+
+# words that mean the same thing in a question about data
+SYNONYMS = {
+    "monthly": "month", "yearly": "year", "annual": "year", "annually": "year",
+    "daily": "day", "weekly": "week", "quarterly": "quarter",
+    "avg": "average", "mean": "average", "sum": "total", "number": "count", "many": "count",
+    "biggest": "top", "largest": "top", "highest": "top", "best": "top",
+    "smallest": "bottom", "lowest": "bottom", "worst": "bottom",
+    "minimum": "min", "maximum": "max", "unique": "distinct",
+    "over": "above", "greater": "above", "more": "above", "exceeding": "above", "exceed": "above",
+    "under": "below", "less": "below", "fewer": "below",
+}
+
+# aggregates, comparisons, orderings and time grains change the SQL, so they must match too
+QUALIFIERS = {
+    "total", "average", "count", "distinct", "min", "max", "median", "above", "below",
+    "top", "bottom", "most", "least", "first", "last", "latest", "earliest", "ascending", "descending",
+    "day", "week", "month", "quarter", "year",
+}
+
+NEGATIONS = {
+    "not", "no", "non", "none", "nor", "never", "without", "except", "excluding", "exclude",
+    "isnt", "arent", "wasnt", "werent", "dont", "doesnt", "didnt",
+}
+
+NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "twenty": "20", "fifty": "50", "hundred": "100",
+}
+
+# schema_key -> list of (entry_id, sparse vector, question)
+_INDEX = {}
+
+
+def schema_key(columns: list[str]) -> str:
+    text = "\n".join(sorted(str(c).strip().lower() for c in columns))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _fold(word: str) -> str:
+    # crude plural folding: "regions" -> "region"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    return NUMBER_WORDS.get(word) or SYNONYMS.get(word, word)
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9_.]+", (text or "").lower().replace("'", ""))
+
+
+def _words(text: str) -> list[str]:
+    return [_fold(w) for w in _tokens(text) if w not in STOPWORDS]
+
+
+def _guards(question: str, columns: list[str]) -> tuple:
+    """
+    What two questions must agree on exactly before SQL is reused:
+    negation count, numbers, aggregate/comparison/order/time-grain words, the
+    column names mentioned and any other literal (e.g. a status or region value).
+    """
+    column_words = set()
+    for c in columns:
+        name = str(c).strip().lower()
+        column_words.add(_fold(name))
+        column_words.update(_fold(p) for p in re.split(r"[^a-z0-9]+", name) if p)
+
+    tokens = _tokens(question)
+    negations = sum(1 for t in tokens if t in NEGATIONS)
+    numbers = sorted(
+        NUMBER_WORDS.get(t, t) for t in tokens
+        if t in NUMBER_WORDS or re.fullmatch(r"\d+(?:\.\d+)?", t)
+    )
+    folded = {_fold(t) for t in tokens if t not in STOPWORDS and t not in NEGATIONS}
+    literals = {
+        w for w in folded - QUALIFIERS - column_words - QUERY_WORDS
+        if w not in SYNONYMS.values() and not re.fullmatch(r"\d+(?:\.\d+)?", w)
+    }
+    return negations, numbers, sorted(folded & QUALIFIERS), sorted(folded & column_words), sorted(literals)
+
+
+def match_score(question: str, cached_question: str, columns: list[str], qvec: dict | None = None,
+                cached_vec: dict | None = None) -> float:
+    """
+    Cosine similarity of the two questions, or 0.0 when their guards differ.
+    """
+    if _guards(question, columns) != _guards(cached_question, columns):
+        return 0.0
+    return similarity(qvec or embed(question), cached_vec or embed(cached_question))
+
+
+def _bucket(feature: str) -> int:
+    return int.from_bytes(hashlib.md5(feature.encode("utf-8")).digest()[:4], "little") % DIM
+
+
+def embed(text: str) -> dict:
+    """
+    Sparse, L2-normalized {bucket: weight} vector of the question.
+    Whole words weigh more; trigrams absorb plurals and typos.
+    """
+    vec = {}
+    for word in _words(text):
+        b = _bucket("w:" + word)
+        vec[b] = vec.get(b, 0.0) + 2.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            b = _bucket("c:" + padded[i:i + 3])
+            vec[b] = vec.get(b, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vec.values()))
+    return {k: v / norm for k, v in vec.items()} if norm else {}
+
+
+def similarity(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def _to_template(sql_text: str, table_name: str) -> str:
+    return re.sub(rf"\b{re.escape(table_name)}\b", TABLE_PLACEHOLDER, sql_text)
+
+
+def _load_index(key: str) -> list:
+    if key not in _INDEX:
+        con = _conn()
+        rows = con.execute(
+            "SELECT entry_id, embedding_json, question FROM nl_sql_cache WHERE schema_key=?",
+            [key],
+        ).fetchall()
+        con.close()
+        _INDEX[key] = [(int(r[0]), {int(k): v for k, v in json.loads(r[1]).items()}, r[2]) for r in rows]
+    return _INDEX[key]
+
+
+def _sql_is_valid(sql_text: str) -> bool:
+    """
+    Re-check a cached query against the current version: still read-only,
+    and DuckDB can bind every table/column it references.
+    """
+    safe, _ = is_sql_safe(sql_text)
+    if not safe:
+        return False
+    con = _conn()
+    try:
+        con.execute(f"SELECT * FROM ({sql_text.strip().rstrip(';')}) AS cached_q LIMIT 0")
+        return True
+    except Exception:
+        return False
+    finally:
+        con.close()
+
+
+def lookup(question: str, table_name: str, columns: list[str], min_similarity: float = MIN_SIMILARITY) -> dict | None:
+    """
+    Returns a plan shaped like generate_sql_and_answer() plus
+    "cached": True, "similarity" and "cached_question", or None on a miss.
+    The answer is a neutral note, not the text generated for the cached question.
+    """
+    key = schema_key(columns)
+    qvec = embed(question)
+    if not qvec:
+        return None
+
+    scored = sorted(
+        (
+            (match_score(question, cached_q, columns, qvec=qvec, cached_vec=vec), entry_id, cached_q)
+            for entry_id, vec, cached_q in _load_index(key)
+        ),
+        reverse=True,
+    )
+    for score, entry_id, cached_q in scored:
+        if score < min_similarity:
+            break
+        con = _conn()
+        row = con.execute(
+            "SELECT sql_template, chart_json FROM nl_sql_cache WHERE entry_id=?",
+            [entry_id],
+        ).fetchone()
+        con.close()
+        if not row:
+            continue
+        sql_text = row[0].replace(TABLE_PLACEHOLDER, table_name)
+        if not _sql_is_valid(sql_text):
+            continue
+
+        con = _conn()
+        con.execute(
+            "UPDATE nl_sql_cache SET hits = hits + 1, last_used_at=? WHERE entry_id=?",
+            [datetime.utcnow(), entry_id],
+        )
+        con.close()
+        return {
+            "answer": REUSED_ANSWER,
+            "sql": sql_text,
+            "chart": json.loads(row[1]) if row[1] else None,
+            "error": None,
+            "cached": True,
+            "similarity": float(score),
+            "cached_question": cached_q,
+        }
+    return None
+
+
+def store(question: str, table_name: str, columns: list[str], plan: dict) -> int | None:
+    """
+    Save a plan whose SQL ran successfully (SQL + chart; the answer text is
+    specific to this version's data, so it isn't kept). Returns the entry id.
+    """
+    sql_text = plan.get("sql")
+    qvec = embed(question)
+    if not sql_text or not qvec:
+        return None
+
+    key = schema_key(columns)
+    index = _load_index(key)
+    con = _conn()
+    entry_id = _new_id(con, "nl_sql_cache", "entry_id")
+    now = datetime.utcnow()
+    con.execute(
+        "INSERT INTO nl_sql_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            entry_id,
+            key,
+            question,
+            json.dumps(qvec),
+            _to_template(sql_text, table_name),
+            None,
+            json.dumps(plan["chart"]) if isinstance(plan.get("chart"), dict) else None,
+            0,
+            now,
+            now,
+        ],
+    )
+    con.close()
+    index.append((entry_id, qvec, question))
+    return entry_id
+
+
+# -----------------------------
+# Offline evaluation
+# -----------------------------
+EVAL_COLUMNS = ["order_id", "order_date", "region", "status", "customer", "product", "revenue", "qty"]
+
+# (question, cached question, should reuse)
+EVAL_PAIRS = [
+    ("monthly revenue by region", "revenue per month for each region", True),
+    ("monthly revenue by region", "what is the monthly revenue per region", True),
+    ("total revenue by region", "sum of revenue for each region", True),
+    ("how many orders per status", "number of orders by status", True),
+    ("count orders by status", "order count per status", True),
+    ("top 10 customers by revenue", "top ten customers by revenue", True),
+    ("top 10 customers by revenue", "show me the top 10 customers by revenue", True),
+    ("average qty per product", "mean qty for each product", True),
+    ("orders with status shipped", "show orders whose status is shipped", True),
+    ("revenue by year", "yearly revenue", True),
+    ("orders with status shipped", "orders with status not shipped", False),
+    ("customers with revenue", "customers without revenue", False),
+    ("top 10 customers by revenue", "top 5 customers by revenue", False),
+    ("orders in 2023", "orders in 2024", False),
+    ("revenue by region", "revenue by product", False),
+    ("monthly revenue by region", "monthly qty by region", False),
+    ("count orders by status", "count orders by customer", False),
+    ("average revenue by region", "average revenue by status", False),
+    ("daily revenue", "monthly revenue", False),
+    ("top 10 products by revenue", "bottom 10 products by revenue", False),
+    ("total revenue by region", "average revenue by region", False),
+    ("latest orders", "earliest orders", False),
+    ("distinct customers per region", "customers per region", False),
+    ("orders by status", "orders grouped by status", True),
+    ("revenue trend by month", "monthly revenue trend", True),
+    ("which region has the highest revenue", "top region by revenue", True),
+    ("quarterly revenue", "revenue per quarter", True),
+    ("number of unique customers", "count of distinct customers", True),
+    ("orders where status is open", "open orders by status", True),
+    ("orders with status shipped", "orders with status cancelled", False),
+    ("revenue in europe by month", "revenue in asia by month", False),
+    ("orders from customer acme", "orders from customer globex", False),
+    ("orders placed in march", "orders placed in april", False),
+    ("revenue by region sorted ascending", "revenue by region sorted descending", False),
+]
+
+
+# Held-out pairs: never used to pick MIN_SIMILARITY or the word lists, so
+# they check that the matcher generalizes beyond EVAL_PAIRS.
+HOLDOUT_PAIRS = [
+    ("customers with revenue over 100", "customers with revenue above 100", True),
+    ("orders with qty more than 5", "orders where qty is greater than 5", True),
+    ("revenue by region over time", "revenue over time by region", True),
+    ("revenue trend over time", "revenue over time", True),
+    ("weekly order count", "count of orders per week", True),
+    ("top 3 regions by revenue", "the three regions with highest revenue", True),
+    ("average revenue per customer", "mean revenue by customer", True),
+    ("total qty by product", "sum of qty per product", True),
+    ("orders with status returned", "orders where status is returned", True),
+    ("max revenue by region", "maximum revenue for each region", True),
+    ("customers with revenue over 100", "customers with revenue of 100", False),
+    ("revenue by region over time", "revenue by region", False),
+    ("orders with qty above 5", "orders with qty below 5", False),
+    ("products with revenue greater than 1000", "products with revenue less than 1000", False),
+    ("orders with qty at least 3", "orders with qty at most 3", False),
+    ("revenue per customer in 2022", "revenue per customer", False),
+    ("orders with status pending", "orders with status returned", False),
+    ("average order revenue by month", "average order revenue by week", False),
+    ("top 3 regions by order count", "top 3 regions by revenue", False),
+    ("customers who never ordered", "customers who ordered", False),
+    ("orders with qty between 10 and 20", "orders with qty between 10 and 50", False),
+    ("revenue since 2021", "revenue until 2021", False),
+]
+
+
+def evaluate(threshold: float = MIN_SIMILARITY, pairs: list | None = None,
+             columns: list[str] | None = None) -> dict:
+    """
+    Score the matcher on labelled question pairs (no database or network).
+    """
+    pairs = EVAL_PAIRS if pairs is None else pairs
+    columns = EVAL_COLUMNS if columns is None else columns
+    rows, wrong = [], 0
+    for question, cached_q, expected in pairs:
+        score = match_score(question, cached_q, columns)
+        reused = score >= threshold
+        wrong += reused != expected
+        rows.append({
+            "question": question,
+            "cached_question": cached_q,
+            "score": round(score, 3),
+            "expected": expected,
+            "reused": reused,
+        })
+    tp = sum(r["reused"] and r["expected"] for r in rows)
+    fp = sum(r["reused"] and not r["expected"] for r in rows)
+    fn = sum(not r["reused"] and r["expected"] for r in rows)
+    return {
+        "threshold": threshold,
+        "pairs": len(rows),
+        "wrong": wrong,
+        "precision": round(tp / (tp + fp), 3) if tp + fp else None,
+        "recall": round(tp / (tp + fn), 3) if tp + fn else None,
+        "results": rows,
+    }
@@ -0,0 +1,335 @@
+"""
+Headless CLI for batch jobs (no Streamlit needed).
+
+    python -m app.cli ingest data/*.csv --recipe default --workers 4
+    python -m app.cli apply-recipe 3 4 --recipe default
+    python -m app.cli apply-recipe --glob "monthly/*.csv" --workers 8
+    python -m app.cli profile 3
+    python -m app.cli quality 3 --version 7
+    python -m app.cli add-rule 3 range amount --params '{"min": 0}'
+    python -m app.cli rules 3
+    python -m app.cli diff 3 7 --key order_id
+    python -m app.cli export 3 out.parquet
+    python -m app.cli query "SELECT COUNT(*) FROM ds_3_v_7"
+    python -m app.cli startup-report
+    python -m app.cli cache-eval
+
+Heavy libraries (pandas, duckdb, openai) are imported inside the
+subcommands, so `--help` and argument errors return instantly.
+"""
+import argparse
+import json
+import os
+import sys
+
+RECIPE_CHOICES = ["none", "default", "feature"]
+
+
+def _recipe_by_name(name: str) -> list:
+    from app.core.transforms import DEFAULT_RECIPE, FEATURE_RECIPE
+
+    return {"none": [], "default": DEFAULT_RECIPE, "feature": FEATURE_RECIPE}[name]
+
+
+def _print_json(obj):
+    print(json.dumps(obj, indent=2, default=str))
+
+
+def _resolve_table(dataset_id: int, version_id: int | None) -> str:
+    from app.core.warehouse import get_active_table, set_active_version
+
+    if version_id is None:
+        table_name = get_active_table(dataset_id)
+    else:
+        table_name = set_active_version(dataset_id, version_id)
+    if not table_name:
+        raise SystemExit(f"No table found for dataset_id={dataset_id} version_id={version_id}")
+    return table_name
+
+
+# -----------------------------
+# Subcommands
+# -----------------------------
+def cmd_ingest(args):
+    from app.core.batch import run_batch
+    from app.core.warehouse import init_db, get_version_metadata
+
+    init_db()
+    # same reader, plan and in-flight bound as `apply-recipe --glob`
+    report = run_batch(
+        _recipe_by_name(args.recipe),
+        paths=args.files,
+        dataset_name=args.name,
+        max_workers=args.workers,
+    )
+    for item in report["items"]:
+        meta = get_version_metadata(item["version_id"]) or {}
+        print(
+            f"{item['source']} -> dataset_id={item['dataset_id']} version_id={item['version_id']} "
+            f"rows={item['rows']} "
+            f"memory={meta.get('memory_before_bytes')}B->{meta.get('memory_after_bytes')}B"
+        )
+    for item in report["failed"]:
+        print(f"{item['source']} -> FAILED: {item['error']}", file=sys.stderr)
+    return 1 if report["failed"] else 0
+
+
+def cmd_apply_recipe(args):
+    from app.core.batch import run_batch
+    from app.core.warehouse import init_db
+
+    init_db()
+    if not args.dataset_ids and not args.glob:
+        raise SystemExit("Give dataset ids and/or --glob.")
+    try:
+        report = run_batch(
+            _recipe_by_name(args.recipe),
+            dataset_ids=args.dataset_ids,
+            pattern=args.glob,
+            max_workers=args.workers,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for item in report["items"]:
+        print(f"{item['source']} -> dataset_id={item['dataset_id']} version_id={item['version_id']} rows={item['rows']}")
+    for item in report["failed"]:
+        print(f"{item['source']} -> FAILED: {item['error']}", file=sys.stderr)
+    print(
+        f"{len(report['items'])} versions, {report['rows']} rows, {report['schemas']} schema(s) "
+        f"in {report['seconds']}s ({report['rows_per_sec']} rows/s)"
+    )
+    return 1 if report["failed"] else 0
+
+
+def cmd_profile(args):
+    from app.core.profiling import basic_profile
+    from app.core.samples import build_sample, load_sample
+    from app.core.warehouse import init_db, sql_scalar
+
+    init_db()
+    table_name = _resolve_table(args.dataset_id, args.version)
+    if args.resample:
+        build_sample(table_name, rows=args.resample, stratify_by=args.stratify_by)
+    prof = basic_profile(load_sample(table_name))
+    prof["full_rows"] = int(sql_scalar(f"SELECT COUNT(*) FROM {table_name}"))
+    prof["table"] = table_name
+    _print_json(prof)
+    return 0
+
+
+def cmd_quality(args):
+    from app.core.quality import quality_report
+    from app.core.warehouse import init_db, sql
+
+    init_db()
+    table_name = _resolve_table(args.dataset_id, args.version)
+    qr = quality_report(sql(f"SELECT * FROM {table_name}"))
+    qr["table"] = table_name
+    _print_json(qr)
+    return 0
+
+
+def cmd_diff(args):
+    from app.core.diff import diff_versions
+    from app.core.warehouse import init_db
+
+    init_db()
+    try:
+        summary = diff_versions(args.version_a, args.version_b, key_columns=args.key, refresh=args.refresh)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if not args.all_columns:
+        summary["column_drift"] = [d for d in summary["column_drift"] if d["changed"]]
+    _print_json(summary)
+    return 0
+
+
+def cmd_add_rule(args):
+    from app.core.quality_rules import add_rule
+    from app.core.warehouse import init_db
+
+    init_db()
+    try:
+        params = json.loads(args.params) if args.params else {}
+        rule_id = add_rule(args.dataset_id, args.rule_type, args.column, params)
+    except (ValueError, json.JSONDecodeError) as e:
+        raise SystemExit(str(e))
+    print(f"rule_id={rule_id}")
+    return 0
+
+
+def cmd_rules(args):
+    from app.core.quality_rules import evaluate_dataset, evaluate_version
+    from app.core.warehouse import init_db
+
+    init_db()
+    try:
+        if args.version is None:
+            out = evaluate_dataset(args.dataset_id)
+        else:
+            out = [evaluate_version(args.dataset_id, args.version, refresh=args.refresh)]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    _print_json(out)
+    failed = any(r["passed"] is False for v in out for r in v["results"])
+    return 1 if failed else 0
+
+
+def cmd_export(args):
+    from app.core.warehouse import init_db, export_table
+
+    init_db()
+    table_name = _resolve_table(args.dataset_id, args.version)
+    try:
+        export_table(table_name, args.path)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{table_name} -> {args.path}")
+    return 0
+
+
+def cmd_query(args):
+    import duckdb
+    from app.core.sql_safety import is_sql_safe, enforce_limit
+    from app.core.warehouse import init_db, sql
+
+    init_db()
+    safe, reason = is_sql_safe(args.sql)
+    if not safe:
+        raise SystemExit(f"Blocked unsafe SQL: {reason}")
+    try:
+        df = sql(enforce_limit(args.sql, limit=args.limit))
+    except duckdb.Error as e:
+        raise SystemExit(f"Query failed: {e}")
+    if args.format == "csv":
+        df.to_csv(sys.stdout, index=False)
+    elif args.format == "json":
+        print(df.to_json(orient="records", date_format="iso"))
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+
+def cmd_startup_report(args):
+    import time
+    from app.core.startup import import_report
+
+    try:
+        report = import_report(args.modules, top=args.top)
+    except RuntimeError as e:
+        raise SystemExit(f"Import failed: {e}")
+
+    from app.core import warehouse
+
+    warehouse.init_db()  # may run the DDL
+    warehouse.reset_schema_check()
+    started = time.perf_counter()
+    warehouse.init_db()  # what a fresh process pays on an up-to-date workspace
+    report["init_db_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    started = time.perf_counter()
+    warehouse.init_db()  # what every Streamlit rerun pays
+    report["init_db_rerun_ms"] = round((time.perf_counter() - started) * 1000.0, 3)
+
+    _print_json(report)
+    return 1 if report["over_budget"] else 0
+
+
+def cmd_cache_eval(args):
+    from app.agent.sql_cache import EVAL_PAIRS, HOLDOUT_PAIRS, MIN_SIMILARITY, evaluate
+
+    threshold = MIN_SIMILARITY if args.threshold is None else args.threshold
+    # "tuning" is in-sample (the threshold was picked on it); "holdout" is not
+    report = {
+        "tuning": evaluate(threshold=threshold, pairs=EVAL_PAIRS),
+        "holdout": evaluate(threshold=threshold, pairs=HOLDOUT_PAIRS),
+    }
+    for part in report.values():
+        if not args.verbose:
+            part["results"] = [r for r in part["results"] if r["reused"] != r["expected"]]
+    _print_json(report)
+    return 1 if any(part["wrong"] for part in report.values()) else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="AI Data Copilot (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="load CSV/Excel files as new datasets")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--name", help="dataset name (default: file name)")
+    p.add_argument("--recipe", choices=RECIPE_CHOICES, default="none")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("apply-recipe", help="create a cleaned version of each dataset / file")
+    p.add_argument("dataset_ids", nargs="*", type=int)
+    p.add_argument("--glob", help="also clean files matching this pattern (each becomes a dataset)")
+    p.add_argument("--recipe", choices=RECIPE_CHOICES[1:], default="default")
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=cmd_apply_recipe)
+
+    p = sub.add_parser("profile", help="profile a dataset version (sample)")
+    p.add_argument("dataset_id", type=int)
+    p.add_argument("--version", type=int)
+    p.add_argument("--resample", type=int, metavar="ROWS", help="rebuild the stored sample with this many rows")
+    p.add_argument("--stratify-by", help="column to stratify the rebuilt sample on")
+    p.set_defaults(func=cmd_profile)
+
+    p = sub.add_parser("quality", help="run quality checks on a dataset version")
+    p.add_argument("dataset_id", type=int)
+    p.add_argument("--version", type=int)
+    p.set_defaults(func=cmd_quality)
+
+    p = sub.add_parser("add-rule", help="store a quality rule for a dataset")
+    p.add_argument("dataset_id", type=int)
+    p.add_argument("rule_type", choices=["not_null", "unique", "range", "regex", "allowed_set", "referential", "freshness"])
+    p.add_argument("column")
+    p.add_argument("--params", help='JSON, e.g. \'{"min": 0, "max": 100}\'')
+    p.set_defaults(func=cmd_add_rule)
+
+    p = sub.add_parser("rules", help="evaluate a dataset's quality rules (exit 1 if any fail)")
+    p.add_argument("dataset_id", type=int)
+    p.add_argument("--version", type=int, help="one version (default: every version, incrementally)")
+    p.add_argument("--refresh", action="store_true", help="ignore the cached result (with --version)")
+    p.set_defaults(func=cmd_rules)
+
+    p = sub.add_parser("diff", help="compare two versions (schema, rows, column drift)")
+    p.add_argument("version_a", type=int)
+    p.add_argument("version_b", type=int)
+    p.add_argument("--key", nargs="+", help="match rows on these columns instead of whole-row hashes")
+    p.add_argument("--refresh", action="store_true", help="ignore the cached summary")
+    p.add_argument("--all-columns", action="store_true", help="include columns without drift")
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser("export", help="export a dataset version to .csv, .parquet or .xlsx")
+    p.add_argument("dataset_id", type=int)
+    p.add_argument("path")
+    p.add_argument("--version", type=int)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("query", help="run a read-only SQL query")
+    p.add_argument("sql")
+    p.add_argument("--limit", type=int, default=5000)
+    p.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("startup-report", help="profile import time and schema init against the startup budget")
+    p.add_argument("--modules", nargs="+", default=["pandas", "streamlit", "app.core.warehouse", "app.agent.openai_agent", "app.agent.sql_cache"])
+    p.add_argument("--top", type=int, default=15)
+    p.set_defaults(func=cmd_startup_report)
+
+    p = sub.add_parser("cache-eval", help="score the AI chat question matcher on its tuning and held-out pairs (offline)")
+    p.add_argument("--threshold", type=float, help="similarity threshold to score (default: the configured one)")
+    p.add_argument("--verbose", action="store_true", help="list every pair, not just the misclassified ones")
+    p.set_defaults(func=cmd_cache_eval)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
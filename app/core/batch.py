@@ -0,0 +1,166 @@
+"""
+Apply one recipe to many datasets / files in a single pass.
+
+1. Read a small sample of every input and group inputs by schema.
+2. plan_recipe() once per schema (column renames, date formats).
+3. Load + transform inputs, with at most `max_in_flight` frames in memory
+   at a time. Files are parsed in worker processes (pandas parsing holds
+   the GIL, so threads barely overlap); datasets are read from the
+   warehouse on threads, since DuckDB must stay in this process.
+4. The calling thread is the only warehouse writer: it saves each result
+   as it is ready (a new version for datasets, a new dataset for files).
+
+This is the one file-ingest path: `cli ingest` calls run_batch too.
+"""
+import glob as globlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+from app.core.transforms import apply_recipe, plan_recipe, recipe_to_json
+from app.core.warehouse import create_dataset_from_df, create_version_from_df, get_active_table, sql
+
+SAMPLE_ROWS = 200
+
+
+def _read_file(path: str, nrows: int | None = None) -> pd.DataFrame:
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path, nrows=nrows)
+    return pd.read_excel(path, nrows=nrows)
+
+
+def _collect_sources(dataset_ids: list[int] | None, pattern: str | None, paths: list[str] | None) -> tuple:
+    """
+    (sources, failed): a dataset without versions is reported, not fatal.
+    """
+    sources, failed = [], []
+    for dataset_id in dataset_ids or []:
+        table_name = get_active_table(int(dataset_id))
+        if not table_name:
+            failed.append({"source": f"dataset {dataset_id}", "error": "dataset has no versions"})
+            continue
+        sources.append({"kind": "dataset", "dataset_id": int(dataset_id), "table": table_name})
+    for path in list(paths or []) + (sorted(globlib.glob(pattern)) if pattern else []):
+        sources.append({"kind": "file", "path": path})
+    return sources, failed
+
+
+def _load_sample(src: dict) -> pd.DataFrame:
+    if src["kind"] == "dataset":
+        return sql(f"SELECT * FROM {src['table']} LIMIT {SAMPLE_ROWS}")
+    return _read_file(src["path"], nrows=SAMPLE_ROWS)
+
+
+def _build_dataset(table_name: str, recipe: list, plan: dict) -> tuple:
+    started = time.perf_counter()
+    out = apply_recipe(sql(f"SELECT * FROM {table_name}"), recipe, plan=plan)
+    return out, time.perf_counter() - started
+
+
+def _build_file(path: str, recipe: list, plan: dict) -> tuple:
+    """
+    Worker: runs in a child process, so it only parses and transforms;
+    the parent writes the result.
+    """
+    started = time.perf_counter()
+    out = apply_recipe(_read_file(path), recipe, plan=plan)
+    return out, time.perf_counter() - started
+
+
+def _label(src: dict) -> str:
+    return src["path"] if src["kind"] == "file" else f"dataset {src['dataset_id']}"
+
+
+def run_batch(
+    recipe: list,
+    dataset_ids: list[int] | None = None,
+    pattern: str | None = None,
+    paths: list[str] | None = None,
+    dataset_name: str | None = None,
+    max_workers: int = 4,
+    max_in_flight: int | None = None,
+) -> dict:
+    """
+    Run `recipe` over the latest version of each dataset id, every file in
+    `paths` and every file matching the glob `pattern`. Datasets get a new
+    version; files become new datasets, named `dataset_name` or the file name.
+    Returns a throughput report.
+    """
+    started = time.perf_counter()
+    max_workers = max(1, int(max_workers))
+    max_in_flight = max(1, int(max_in_flight or max_workers))
+    recipe_json = recipe_to_json(recipe)
+
+    # plan shared work once per schema
+    sources, failed = _collect_sources(dataset_ids, pattern, paths)
+    items, pending, plans = [], [], {}
+    for src in sources:
+        try:
+            sample = _load_sample(src)
+            src["schema"] = tuple(str(c) for c in sample.columns)
+            if src["schema"] not in plans:
+                plans[src["schema"]] = plan_recipe(sample, recipe)
+        except Exception as e:
+            failed.append({"source": _label(src), "error": str(e)})
+            continue
+        pending.append(src)
+    plan_seconds = time.perf_counter() - started
+
+    running = {}
+    n_files = sum(1 for src in pending if src["kind"] == "file")
+    n_datasets = len(pending) - n_files
+    # one in-flight bound across both pools; `wait` takes futures from either
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, n_files))) as procs, \
+            ThreadPoolExecutor(max_workers=max(1, min(max_workers, n_datasets))) as threads:
+        while pending or running:
+            while pending and len(running) < max_in_flight:
+                src = pending.pop(0)
+                plan = plans[src["schema"]]
+                if src["kind"] == "dataset":
+                    fut = threads.submit(_build_dataset, src["table"], recipe, plan)
+                else:
+                    fut = procs.submit(_build_file, src["path"], recipe, plan)
+                running[fut] = src
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                src = running.pop(fut)
+                try:
+                    out, build_seconds = fut.result()
+                    if src["kind"] == "dataset":
+                        dataset_id = src["dataset_id"]
+                        version_id = create_version_from_df(
+                            dataset_id, out, source_filename="(batch)", recipe_json=recipe_json
+                        )
+                    else:
+                        source_filename = os.path.basename(src["path"])
+                        dataset_id, version_id = create_dataset_from_df(
+                            dataset_name or source_filename, out,
+                            source_filename=source_filename, recipe_json=recipe_json,
+                        )
+                except Exception as e:
+                    failed.append({"source": _label(src), "error": str(e)})
+                    continue
+                items.append({
+                    "source": _label(src),
+                    "dataset_id": dataset_id,
+                    "version_id": version_id,
+                    "rows": int(out.shape[0]),
+                    "build_seconds": round(build_seconds, 3),
+                })
+                del out
+
+    elapsed = time.perf_counter() - started
+    total_rows = sum(i["rows"] for i in items)
+    return {
+        "items": items,
+        "failed": failed,
+        "schemas": len(plans),
+        "rows": total_rows,
+        "plan_seconds": round(plan_seconds, 3),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(total_rows / elapsed, 1) if elapsed else None,
+        "items_per_sec": round(len(items) / elapsed, 2) if elapsed else None,
+    }
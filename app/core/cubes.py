@@ -0,0 +1,315 @@
+"""
+Materialized aggregate "cubes" per version table.
+
+When a version is created we pre-build small rollup tables:
+  - one per low-cardinality column (GROUP BY col)
+  - year / month buckets per date column
+each with COUNT(*) plus SUM/MIN/MAX/COUNT for the numeric columns.
+
+rewrite_query() then serves simple aggregate queries such as
+
+    SELECT status, COUNT(*) AS n, AVG(amount) FROM ds_1_v_2 GROUP BY status ORDER BY n DESC
+
+from the rollup instead of scanning the base table. Anything it does
+not fully understand (WHERE, JOIN, HAVING, ...) is left untouched.
+
+Functions take an open DuckDB connection so warehouse.py can call them
+without a circular import.
+"""
+import json
+import re
+from datetime import datetime
+
+from app.core.profiling import NUMERIC_TYPES
+
+MAX_GROUPS = 1000        # a column with more distinct values gets no cube
+MAX_GROUP_COLUMNS = 30
+MAX_DATE_COLUMNS = 5
+MAX_MEASURES = 20
+
+_STATS = {"hits": 0, "misses": 0, "errors": 0}
+
+_IDENT = r'(?:"(?:[^"]|"")+"|[A-Za-z_][A-Za-z0-9_]*)'
+_QUERY_RE = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>[A-Za-z_][A-Za-z0-9_]*)\s+"
+    r"GROUP\s+BY\s+(?P<group>.+?)"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_AGG_RE = re.compile(r"^(COUNT|SUM|MIN|MAX|AVG)\s*\(\s*(\*|" + _IDENT + r")\s*\)$", re.IGNORECASE)
+_TRUNC_RE = re.compile(r"^DATE_TRUNC\s*\(\s*'(year|month)'\s*,\s*(" + _IDENT + r")\s*\)$", re.IGNORECASE)
+_YEAR_RE = re.compile(r"^YEAR\s*\(\s*(" + _IDENT + r")\s*\)$", re.IGNORECASE)
+_ALIAS_RE = re.compile(r"^(?P<expr>.+?)\s+(?:AS\s+)?(?P<alias>" + _IDENT + r")$", re.IGNORECASE | re.DOTALL)
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _ident(text: str) -> str | None:
+    """
+    Canonical (lower-case, unquoted) column name, or None if not an identifier.
+    """
+    text = text.strip()
+    if not re.fullmatch(_IDENT, text):
+        return None
+    if text.startswith('"'):
+        text = text[1:-1].replace('""', '"')
+    return text.lower()
+
+
+def _group_key(expr: str) -> str | None:
+    """
+    col -> "col:<name>", year(col) -> "year:<name>", date_trunc('month', col) -> "month_trunc:<name>"
+    """
+    expr = expr.strip()
+    m = _TRUNC_RE.match(expr)
+    if m:
+        return f"{m.group(1).lower()}_trunc:{_ident(m.group(2))}"
+    m = _YEAR_RE.match(expr)
+    if m:
+        return f"year:{_ident(m.group(1))}"
+    name = _ident(expr)
+    return f"col:{name}" if name else None
+
+
+def _split_top_level(text: str) -> list[str]:
+    parts, depth, quote, cur = [], 0, None, []
+    for ch in text:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append("".join(cur).strip())
+            cur = []
+            continue
+        cur.append(ch)
+    parts.append("".join(cur).strip())
+    return parts
+
+
+def _split_alias(item: str) -> tuple:
+    """
+    "COUNT(*) AS n" -> ("COUNT(*)", "n"); "status" -> ("status", None)
+    """
+    m = _ALIAS_RE.match(item)
+    if m:
+        expr = m.group("expr").strip()
+        if _group_key(expr) or _AGG_RE.match(expr):
+            return expr, m.group("alias")
+    return item.strip(), None
+
+
+def _norm(text: str) -> str:
+    return _ident(text) or re.sub(r"\s+", "", text.lower())
+
+
+def _unquote(text: str) -> str:
+    text = text.strip()
+    if text.startswith('"') and text.endswith('"'):
+        return text[1:-1].replace('""', '"')
+    return text
+
+
+def _default_name(expr: str) -> str:
+    """
+    The column name DuckDB gives an un-aliased expression, e.g. COUNT(*) -> count_star().
+    """
+    m = _AGG_RE.match(expr)
+    if m:
+        if m.group(2) == "*":
+            return "count_star()"
+        return f"{m.group(1).lower()}({m.group(2)})"
+    m = _TRUNC_RE.match(expr)
+    if m:
+        return f"date_trunc('{m.group(1)}', {m.group(2)})"
+    m = _YEAR_RE.match(expr)
+    if m:
+        return f'"year"({m.group(1)})'
+    return _unquote(expr)
+
+
+# -----------------------------
+# Build
+# -----------------------------
+def build_cubes(con, table_name: str, distinct: dict | None = None) -> int:
+    """
+    Create the rollup tables for one version table and register them.
+    `distinct` maps column -> approx distinct count (e.g. from column_stats);
+    without it one extra scan measures cardinality. All rollups come from a
+    single GROUPING SETS scan and are then split into one table each.
+    Returns the number of cubes built.
+    """
+    cols = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name=? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    if not cols:
+        return 0
+
+    numeric = [c for c, t in cols if t in NUMERIC_TYPES or t.startswith("DECIMAL")][:MAX_MEASURES]
+    dates = [c for c, t in cols if t == "DATE" or t.startswith("TIMESTAMP")][:MAX_DATE_COLUMNS]
+    others = [c for c, _ in cols if c not in dates]
+
+    # low-cardinality columns
+    groups = []
+    if others:
+        if distinct is None:
+            approx = con.execute(
+                "SELECT " + ", ".join(f"approx_count_distinct({_q(c)})" for c in others) + f" FROM {table_name}"
+            ).fetchone()
+            distinct = dict(zip(others, approx))
+        groups = [c for c in others if distinct.get(c) is not None and distinct[c] <= MAX_GROUPS][:MAX_GROUP_COLUMNS]
+
+    specs = [(f"col:{c.lower()}", _q(c)) for c in groups]
+    for c in dates:
+        specs.append((f"year:{c.lower()}", f"year({_q(c)})"))
+        specs.append((f"year_trunc:{c.lower()}", f"date_trunc('year', {_q(c)})"))
+        specs.append((f"month_trunc:{c.lower()}", f"date_trunc('month', {_q(c)})"))
+
+    measures = {c.lower(): i for i, c in enumerate(numeric)}
+    measure_sql, measure_names = [], []
+    for c in numeric:
+        i = measures[c.lower()]
+        measure_sql += [
+            f"SUM({_q(c)}) AS sum__{i}",
+            f"MIN({_q(c)}) AS min__{i}",
+            f"MAX({_q(c)}) AS max__{i}",
+            f"COUNT({_q(c)}) AS cnt__{i}",
+        ]
+        measure_names += [f"sum__{i}", f"min__{i}", f"max__{i}", f"cnt__{i}"]
+
+    con.execute("DELETE FROM aggregate_cubes WHERE table_name=?", [table_name])
+    if not specs:
+        return 0
+
+    # one scan: every group expression as g<n>, one grouping set per cube;
+    # GROUPING() has a 0 bit only for the set a row belongs to
+    grouped = [f"g{n}" for n in range(len(specs))]
+    inner = ", ".join([f"{expr} AS g{n}" for n, (_, expr) in enumerate(specs)] + [_q(c) for c in numeric])
+    select = ", ".join(grouped + [f"GROUPING({', '.join(grouped)}) AS grp_set", "COUNT(*) AS n"] + measure_sql)
+    sets = ", ".join(f"({g})" for g in grouped)
+    all_cubes = f"{table_name}__cubes"
+    con.execute(
+        f"CREATE OR REPLACE TEMP TABLE {all_cubes} AS "
+        f"SELECT {select} FROM (SELECT {inner} FROM {table_name}) GROUP BY GROUPING SETS ({sets})"
+    )
+
+    full_mask = (1 << len(specs)) - 1
+    for n, (key, _) in enumerate(specs):
+        cube_table = f"{table_name}__cube_{n}"
+        mask = full_mask & ~(1 << (len(specs) - 1 - n))
+        cube_cols = ", ".join([f"g{n} AS grp", "n"] + measure_names)
+        con.execute(f"CREATE OR REPLACE TABLE {cube_table} AS SELECT {cube_cols} FROM {all_cubes} WHERE grp_set = {mask}")
+        con.execute(
+            "INSERT INTO aggregate_cubes VALUES (?, ?, ?, ?, ?)",
+            [table_name, key, cube_table, json.dumps(measures), datetime.utcnow()],
+        )
+    con.execute(f"DROP TABLE {all_cubes}")
+    return len(specs)
+
+
+# -----------------------------
+# Rewrite
+# -----------------------------
+def _agg_column(expr: str, measures: dict) -> str | None:
+    m = _AGG_RE.match(expr.strip())
+    if not m:
+        return None
+    fn, arg = m.group(1).upper(), m.group(2)
+    if arg == "*":
+        return "n" if fn == "COUNT" else None
+    i = measures.get(_ident(arg))
+    if i is None:
+        return None
+    if fn == "AVG":
+        return f"sum__{i} / NULLIF(cnt__{i}, 0)"
+    return {"COUNT": f"cnt__{i}", "SUM": f"sum__{i}", "MIN": f"min__{i}", "MAX": f"max__{i}"}[fn]
+
+
+def rewrite_query(con, query: str) -> str | None:
+    """
+    Return SQL that reads from a cube, or None if the query can't be served
+    by one (it then runs unchanged). Output column names match what DuckDB
+    would have produced for the original query.
+    """
+    m = _QUERY_RE.match(query or "")
+    if not m:
+        return None
+
+    items = [_split_alias(x) for x in _split_top_level(m.group("select"))]
+    group = m.group("group").strip()
+    if group.isdigit() and 1 <= int(group) <= len(items):
+        group = items[int(group) - 1][0]
+    else:
+        for expr, alias in items:
+            if alias and _ident(alias) == _ident(group):
+                group = expr
+    key = _group_key(group)
+
+    row = None
+    if key:
+        row = con.execute(
+            "SELECT cube_table, measures_json FROM aggregate_cubes WHERE table_name=? AND group_key=?",
+            [m.group("table"), key],
+        ).fetchone()
+    if not row:
+        _STATS["misses"] += 1
+        return None
+    cube_table, measures = row[0], json.loads(row[1])
+
+    select, names = [], {}
+    for expr, alias in items:
+        src = "grp" if _group_key(expr) == key else _agg_column(expr, measures)
+        if src is None:
+            _STATS["misses"] += 1
+            return None
+        name = _unquote(alias) if alias else _default_name(expr)
+        select.append(f"{src} AS {_q(name)}")
+        names[_norm(expr)] = name
+        if alias:
+            names[_norm(alias)] = name
+
+    out = f"SELECT * FROM (SELECT {', '.join(select)} FROM {cube_table}) AS cube_q"
+    if m.group("order"):
+        order = []
+        for part in _split_top_level(m.group("order")):
+            om = re.match(r"^(?P<expr>.+?)(?P<dir>\s+(?:ASC|DESC))?(?P<nulls>\s+NULLS\s+(?:FIRST|LAST))?$",
+                          part, re.IGNORECASE)
+            expr = om.group("expr").strip()
+            if expr.isdigit():
+                target = expr
+            else:
+                name = names.get(_norm(expr))
+                if name is None:
+                    _STATS["misses"] += 1
+                    return None
+                target = _q(name)
+            order.append(target + (om.group("dir") or "") + (om.group("nulls") or ""))
+        out += " ORDER BY " + ", ".join(order)
+    if m.group("limit"):
+        out += f" LIMIT {int(m.group('limit'))}"
+
+    _STATS["hits"] += 1
+    return out
+
+
+def record_error():
+    """
+    A rewritten query failed and was re-run on the base table.
+    """
+    _STATS["hits"] -= 1
+    _STATS["misses"] += 1
+    _STATS["errors"] += 1
+
+
+def cube_stats() -> dict:
+    total = _STATS["hits"] + _STATS["misses"]
+    return {**_STATS, "hit_rate": (_STATS["hits"] / total) if total else None}
@@ -0,0 +1,275 @@
+"""
+Compare two dataset versions inside DuckDB (no pandas load).
+
+Summary covers:
+  - schema: added / removed columns, logical type changes
+  - row counts
+  - rows added / removed (multiset of row hashes, or by key columns)
+  - per-column stat drift (nulls, distinct, min/max/mean)
+
+Versions never change after creation, so every summary is cached in
+version_diffs. Per-version column stats come from version_column_stats,
+and row hashes are materialized once per version in <table>__rowhash.
+"""
+import json
+import math
+from datetime import datetime
+
+from app.core.profiling import column_stats
+from app.core.warehouse import _conn, save_column_stats
+
+SAMPLE_KEYS = 5
+MEAN_REL_TOLERANCE = 1e-6    # float32 vs float64 storage of the same values
+DISTINCT_REL_TOLERANCE = 0.02  # approx_count_distinct is an estimate
+
+# physical types that only differ by encoding/width collapse to one logical type,
+# so an ENUM vs VARCHAR or TINYINT vs BIGINT column isn't reported as a change
+LOGICAL_TYPES = {
+    "TINYINT": "BIGINT", "SMALLINT": "BIGINT", "INTEGER": "BIGINT",
+    "UTINYINT": "BIGINT", "USMALLINT": "BIGINT", "UINTEGER": "BIGINT",
+    "FLOAT": "DOUBLE", "REAL": "DOUBLE",
+}
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _logical(data_type: str) -> str:
+    if data_type.startswith("ENUM"):
+        return "VARCHAR"
+    return LOGICAL_TYPES.get(data_type, data_type)
+
+
+def _columns(con, table_name: str) -> list[tuple]:
+    return con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name=? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+
+
+def _table_exists(con, table_name: str) -> bool:
+    return bool(con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name=?", [table_name]
+    ).fetchone()[0])
+
+
+def _hash_expr(cols: list[tuple]) -> str:
+    parts = []
+    for c, t in cols:
+        logical = _logical(t)
+        parts.append(_q(c) if logical == t else f"CAST({_q(c)} AS {logical})")
+    return f"hash({', '.join(parts)})"
+
+
+def _version_table(con, version_id: int) -> str:
+    row = con.execute("SELECT table_name FROM dataset_versions WHERE version_id=?", [version_id]).fetchone()
+    if not row:
+        raise ValueError(f"Unknown version_id={version_id}")
+    return row[0]
+
+
+def _stats(con, version_id: int, table_name: str) -> dict:
+    rows = con.execute(
+        "SELECT column_name, data_type, row_count, null_count, distinct_approx, min_value, max_value, mean "
+        "FROM version_column_stats WHERE version_id=?",
+        [version_id],
+    ).fetchall()
+    if not rows:
+        # versions created before stats were recorded: compute once and keep
+        stats = column_stats(con, table_name)
+        save_column_stats(con, version_id, stats)
+        return {s["column"]: s for s in stats}
+    keys = ["column", "data_type", "row_count", "null_count", "distinct_approx", "min", "max", "mean"]
+    return {r[0]: dict(zip(keys, r)) for r in rows}
+
+
+def _rowhash_table(con, table_name: str, cols: list[tuple]) -> str:
+    """
+    <table>__rowhash holds one hash per row over all columns. Built on first use.
+    """
+    hash_table = f"{table_name}__rowhash"
+    if not _table_exists(con, hash_table):
+        con.execute(f"CREATE TABLE {hash_table} AS SELECT {_hash_expr(cols)} AS h FROM {table_name}")
+    return hash_table
+
+
+def _row_changes_by_hash(con, table_a, cols_a, table_b, cols_b) -> dict:
+    same_schema = [(c, _logical(t)) for c, t in cols_a] == [(c, _logical(t)) for c, t in cols_b]
+    if same_schema:
+        src_a = f"SELECT h FROM {_rowhash_table(con, table_a, cols_a)}"
+        src_b = f"SELECT h FROM {_rowhash_table(con, table_b, cols_b)}"
+        basis = "all columns"
+    else:
+        names_b = {c for c, _ in cols_b}
+        common = [(c, t) for c, t in cols_a if c in names_b]
+        if not common:
+            return {"basis": "no common columns", "rows_added": None, "rows_removed": None}
+        types_b = dict(cols_b)
+        src_a = f"SELECT {_hash_expr(common)} AS h FROM {table_a}"
+        src_b = f"SELECT {_hash_expr([(c, types_b[c]) for c, _ in common])} AS h FROM {table_b}"
+        basis = "common columns"
+
+    # multiset difference: duplicates count, row order doesn't
+    added, removed = con.execute(f"""
+        WITH a AS (SELECT h, COUNT(*) AS n FROM ({src_a}) GROUP BY h),
+             b AS (SELECT h, COUNT(*) AS n FROM ({src_b}) GROUP BY h)
+        SELECT
+            COALESCE(SUM(GREATEST(COALESCE(b.n, 0) - COALESCE(a.n, 0), 0)), 0),
+            COALESCE(SUM(GREATEST(COALESCE(a.n, 0) - COALESCE(b.n, 0), 0)), 0)
+        FROM a FULL OUTER JOIN b ON a.h = b.h
+    """).fetchone()
+    return {"basis": basis, "rows_added": int(added), "rows_removed": int(removed)}
+
+
+def _row_changes_by_key(con, table_a, cols_a, table_b, cols_b, key_columns: list[str]) -> dict:
+    types_a, types_b = dict(cols_a), dict(cols_b)
+    missing = [k for k in key_columns if k not in types_a or k not in types_b]
+    if missing:
+        raise ValueError(f"Key column(s) not in both versions: {missing}")
+
+    values = [c for c, _ in cols_a if c in types_b and c not in key_columns]
+
+    def side(table_name: str, types: dict) -> str:
+        # keys cast to one logical type on both sides so ENUM/width changes still join
+        keys = [f"CAST({_q(k)} AS {_logical(types[k])}) AS k{i}" for i, k in enumerate(key_columns)]
+        h = _hash_expr([(c, types[c]) for c in values]) if values else "0"
+        return f"(SELECT {', '.join(keys)}, {h} AS h FROM {table_name})"
+
+    a, b = side(table_a, types_a), side(table_b, types_b)
+
+    # duplicate keys would turn the join into a cross product and inflate every count
+    key_refs = ", ".join(f"k{i}" for i in range(len(key_columns)))
+    not_null = " AND ".join(f"k{i} IS NOT NULL" for i in range(len(key_columns)))
+    for label, src in (("a", a), ("b", b)):
+        dupes = con.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {src} s WHERE {not_null} GROUP BY {key_refs} HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+        if dupes:
+            version = table_a if label == "a" else table_b
+            raise ValueError(
+                f"Key {key_columns} is not unique in {version} ({dupes} duplicated key value(s)); "
+                "pick a unique key or compare whole rows."
+            )
+
+    on = " AND ".join(f"a.k{i} = b.k{i}" for i in range(len(key_columns)))
+    key_list = ", ".join(f"CAST(k{i} AS VARCHAR)" for i in range(len(key_columns)))
+
+    added, removed, changed = con.execute(f"""
+        SELECT
+            COUNT(*) FILTER (WHERE a.h IS NULL),
+            COUNT(*) FILTER (WHERE b.h IS NULL),
+            COUNT(*) FILTER (WHERE a.h <> b.h)
+        FROM {a} a FULL OUTER JOIN {b} b ON {on}
+    """).fetchone()
+    sample_added = con.execute(f"SELECT {key_list} FROM {b} b ANTI JOIN {a} a ON {on} LIMIT {SAMPLE_KEYS}").fetchall()
+    sample_removed = con.execute(f"SELECT {key_list} FROM {a} a ANTI JOIN {b} b ON {on} LIMIT {SAMPLE_KEYS}").fetchall()
+    return {
+        "basis": f"key {key_columns}",
+        "rows_added": int(added),
+        "rows_removed": int(removed),
+        "rows_changed": int(changed),
+        "sample_added_keys": [list(r) for r in sample_added],
+        "sample_removed_keys": [list(r) for r in sample_removed],
+    }
+
+
+def _pct(part, whole):
+    return round(100.0 * part / whole, 3) if whole else 0.0
+
+
+def _close(a, b, rel_tol: float) -> bool:
+    """
+    Equal, or both numeric and within rel_tol (min/max are stored as text).
+    """
+    if a == b:
+        return True
+    try:
+        return math.isclose(float(a), float(b), rel_tol=rel_tol)
+    except (TypeError, ValueError):
+        return False
+
+
+def _drift(stats_a: dict, stats_b: dict, columns: list[str]) -> list[dict]:
+    out = []
+    for c in columns:
+        a, b = stats_a.get(c), stats_b.get(c)
+        if not a or not b:
+            continue
+        row = {
+            "column": c,
+            "null_pct_a": _pct(a["null_count"], a["row_count"]),
+            "null_pct_b": _pct(b["null_count"], b["row_count"]),
+            "distinct_a": a["distinct_approx"],
+            "distinct_b": b["distinct_approx"],
+            "min_a": a["min"], "min_b": b["min"],
+            "max_a": a["max"], "max_b": b["max"],
+            "mean_a": a["mean"], "mean_b": b["mean"],
+        }
+        row["changed"] = not (
+            row["null_pct_a"] == row["null_pct_b"]
+            and _close(row["distinct_a"], row["distinct_b"], DISTINCT_REL_TOLERANCE)
+            and all(_close(row[f"{k}_a"], row[f"{k}_b"], MEAN_REL_TOLERANCE) for k in ("min", "max", "mean"))
+        )
+        out.append(row)
+    return out
+
+
+def diff_versions(version_a: int, version_b: int, key_columns: list[str] | None = None, refresh: bool = False) -> dict:
+    """
+    What changed from version_a to version_b. "added" rows are in b but not a.
+    key_columns switches row matching from whole-row hashes to a key join
+    (and also reports rows whose non-key values changed).
+    """
+    key_json = json.dumps(sorted(key_columns or []))
+    con = _conn()
+    if not refresh:
+        row = con.execute(
+            "SELECT summary_json FROM version_diffs WHERE version_a=? AND version_b=? AND key_json=?",
+            [version_a, version_b, key_json],
+        ).fetchone()
+        if row:
+            con.close()
+            return {**json.loads(row[0]), "cached": True}
+
+    try:
+        table_a, table_b = _version_table(con, version_a), _version_table(con, version_b)
+        cols_a, cols_b = _columns(con, table_a), _columns(con, table_b)
+        types_a = {c: _logical(t) for c, t in cols_a}
+        types_b = {c: _logical(t) for c, t in cols_b}
+        stats_a, stats_b = _stats(con, version_a, table_a), _stats(con, version_b, table_b)
+
+        rows_a = next(iter(stats_a.values()))["row_count"] if stats_a else 0
+        rows_b = next(iter(stats_b.values()))["row_count"] if stats_b else 0
+
+        if key_columns:
+            rows = _row_changes_by_key(con, table_a, cols_a, table_b, cols_b, key_columns)
+        else:
+            rows = _row_changes_by_hash(con, table_a, cols_a, table_b, cols_b)
+
+        summary = {
+            "version_a": version_a,
+            "version_b": version_b,
+            "table_a": table_a,
+            "table_b": table_b,
+            "schema": {
+                "added_columns": [c for c in types_b if c not in types_a],
+                "removed_columns": [c for c in types_a if c not in types_b],
+                "type_changes": [
+                    {"column": c, "from": types_a[c], "to": types_b[c]}
+                    for c in types_a if c in types_b and types_a[c] != types_b[c]
+                ],
+            },
+            "row_count_a": rows_a,
+            "row_count_b": rows_b,
+            "row_count_change": rows_b - rows_a,
+            "rows": rows,
+            "column_drift": _drift(stats_a, stats_b, [c for c, _ in cols_a]),
+        }
+        con.execute(
+            "INSERT OR REPLACE INTO version_diffs VALUES (?, ?, ?, ?, ?)",
+            [version_a, version_b, key_json, json.dumps(summary, default=str), datetime.utcnow()],
+        )
+    finally:
+        con.close()
+    return {**summary, "cached": False}
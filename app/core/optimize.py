@@ -0,0 +1,41 @@
+import pandas as pd
+
+
+def _is_text(s: pd.Series) -> bool:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return False
+    if not pd.api.types.is_string_dtype(s):
+        return False
+    return pd.api.types.infer_dtype(s, skipna=True) == "string"
+
+
+def optimize_dtypes(df: pd.DataFrame, max_categories: int = 1000, max_unique_ratio: float = 0.5) -> tuple:
+    """
+    Shrink a DataFrame before it lands in the warehouse:
+    - low-cardinality text -> pandas `category` (DuckDB stores it as ENUM)
+
+    Numbers keep their width (BIGINT / DOUBLE): DuckDB compresses them on
+    disk anyway, and narrower types change query results (TINYINT overflows
+    in `qty * 10`, FLOAT arithmetic rounds even when every stored value is exact).
+
+    Returns (optimized_df, info) where info has memory before/after (bytes)
+    and the chosen pandas dtype per column.
+    """
+    out = df.copy()
+    before = int(df.memory_usage(deep=True).sum())
+    n_rows = max(int(df.shape[0]), 1)
+
+    for c in out.columns:
+        s = out[c]
+        if _is_text(s):
+            n_unique = int(s.nunique(dropna=True))
+            if n_unique <= max_categories and n_unique / n_rows <= max_unique_ratio:
+                out[c] = s.astype("category")
+
+    after = int(out.memory_usage(deep=True).sum())
+    info = {
+        "memory_before_bytes": before,
+        "memory_after_bytes": after,
+        "dtypes": {str(c): str(out[c].dtype) for c in out.columns},
+    }
+    return out, info
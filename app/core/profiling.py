@@ -1,5 +1,7 @@
 import pandas as pd
 
+from app.core.samples import load_sample
+
 
 def basic_profile(df: pd.DataFrame) -> dict:
     """
@@ -25,3 +27,59 @@ def basic_profile(df: pd.DataFrame) -> dict:
     out["dtypes"] = dtypes
     out["nunique"] = nunique
     return out
+
+
+def profile_version(table_name: str) -> dict:
+    """
+    basic_profile over the version's stored sample (no database scan).
+    """
+    return basic_profile(load_sample(table_name))
+
+
+NUMERIC_TYPES = {
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT",
+    "FLOAT", "REAL", "DOUBLE",
+}
+
+
+def column_stats(con, table_name: str) -> list[dict]:
+    """
+    Per-column stats for a warehouse table in ONE DuckDB scan
+    (no DataFrame). Used for version metadata and diffs.
+    """
+    cols = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name=? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    if not cols:
+        return []
+
+    exprs = ["COUNT(*)"]
+    for c, t in cols:
+        q = '"' + c.replace('"', '""') + '"'
+        numeric = t in NUMERIC_TYPES or t.startswith("DECIMAL")
+        exprs += [
+            f"COUNT({q})",
+            f"approx_count_distinct({q})",
+            f"CAST(MIN({q}) AS VARCHAR)",
+            f"CAST(MAX({q}) AS VARCHAR)",
+            f"AVG({q})" if numeric else "NULL",
+        ]
+    row = con.execute(f"SELECT {', '.join(exprs)} FROM {table_name}").fetchone()
+
+    total = int(row[0])
+    out = []
+    for i, (c, t) in enumerate(cols):
+        non_null, distinct, mn, mx, mean = row[1 + i * 5: 6 + i * 5]
+        out.append({
+            "column": c,
+            "data_type": t,
+            "row_count": total,
+            "null_count": total - int(non_null),
+            "distinct_approx": int(distinct) if distinct is not None else None,
+            "min": mn,
+            "max": mx,
+            "mean": float(mean) if mean is not None else None,
+        })
+    return out
@@ -0,0 +1,341 @@
+"""
+Declarative data-quality rules, stored per dataset.
+
+All rules of a dataset compile into ONE aggregate query over a version
+table, which returns a violation count and the first few offending values
+per rule. Results are cached per (version, rules fingerprint): versions
+never change, so a version is only re-evaluated when its dataset's rules do.
+Freshness rules depend on "now", so their fingerprint includes the date.
+
+add_rule() binds the new rule against the dataset's latest version, so a
+rule that can't run there (wrong column type, bad regex) is rejected. A rule
+that still fails on some version is reported as an error for that rule
+only; the others are evaluated as usual.
+
+Rule types (params in parentheses):
+  not_null
+  unique
+  range         (min and/or max)
+  regex         (pattern; searched, anchor with ^...$ for a full match)
+  allowed_set   (values: list)
+  referential   (version_id, column: defaults to the same column name)
+  freshness     (max_age_days: newest value must be at most this old)
+"""
+import hashlib
+import json
+from datetime import date, datetime
+
+import pandas as pd
+
+from app.core.warehouse import _conn, _new_id, get_active_table
+
+RULE_TYPES = ["not_null", "unique", "range", "regex", "allowed_set", "referential", "freshness"]
+SAMPLE_OFFENDERS = 5
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _lit(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+def add_rule(dataset_id: int, rule_type: str, column_name: str, params: dict | None = None) -> int:
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Unknown rule type: {rule_type}")
+    params = params or {}
+    if rule_type == "range" and params.get("min") is None and params.get("max") is None:
+        raise ValueError("range rule needs min and/or max")
+    if rule_type == "regex" and not params.get("pattern"):
+        raise ValueError("regex rule needs a pattern")
+    if rule_type == "allowed_set" and not params.get("values"):
+        raise ValueError("allowed_set rule needs values")
+    if rule_type == "referential" and params.get("version_id") is None:
+        raise ValueError("referential rule needs version_id")
+    if rule_type == "freshness" and params.get("max_age_days") is None:
+        raise ValueError("freshness rule needs max_age_days")
+
+    rule = {"rule_id": 0, "rule_type": rule_type, "column": column_name, "params": params}
+    table_name = get_active_table(dataset_id)
+    con = _conn()
+    try:
+        if table_name:
+            error = _bind_error(con, table_name, rule)
+            if error:
+                raise ValueError(f"{rule_type} rule on {column_name!r} can't run on {table_name}: {error}")
+        rule_id = _new_id(con, "quality_rules", "rule_id")
+        con.execute(
+            "INSERT INTO quality_rules VALUES (?, ?, ?, ?, ?, ?)",
+            [rule_id, dataset_id, rule_type, column_name, json.dumps(params, sort_keys=True), datetime.utcnow()],
+        )
+    finally:
+        con.close()
+    return rule_id
+
+
+def delete_rule(rule_id: int):
+    con = _conn()
+    con.execute("DELETE FROM quality_rules WHERE rule_id=?", [rule_id])
+    con.close()
+
+
+def list_rules(dataset_id: int) -> pd.DataFrame:
+    con = _conn()
+    df = con.execute(
+        "SELECT rule_id, rule_type, column_name, params_json, created_at FROM quality_rules WHERE dataset_id=? ORDER BY rule_id",
+        [dataset_id],
+    ).df()
+    con.close()
+    return df
+
+
+def _load_rules(con, dataset_id: int) -> list[dict]:
+    rows = con.execute(
+        "SELECT rule_id, rule_type, column_name, params_json FROM quality_rules WHERE dataset_id=? ORDER BY rule_id",
+        [dataset_id],
+    ).fetchall()
+    return [
+        {"rule_id": int(r[0]), "rule_type": r[1], "column": r[2], "params": json.loads(r[3]) if r[3] else {}}
+        for r in rows
+    ]
+
+
+def rules_fingerprint(rules: list[dict]) -> str:
+    payload = json.dumps(rules, sort_keys=True)
+    if any(r["rule_type"] == "freshness" for r in rules):
+        payload += date.today().isoformat()
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# -----------------------------
+# Compile
+# -----------------------------
+def _column_type(con, table_name: str, column: str) -> str | None:
+    row = con.execute(
+        "SELECT data_type FROM information_schema.columns WHERE table_name=? AND lower(column_name)=lower(?)",
+        [table_name, column],
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _allowed_set(con, table_name: str, rule: dict) -> tuple:
+    """
+    (column expr, values) to compare for an allowed_set rule. Values are cast
+    to the column's own type, so a DOUBLE column compares 1.0 with '1' as
+    numbers; text and ENUM columns compare as strings. Raises if a value
+    doesn't convert to the column type.
+    """
+    col = _q(rule["column"])
+    values = [_lit(str(v)) for v in rule["params"]["values"]]
+    col_type = _column_type(con, table_name, rule["column"])
+    if not col_type or col_type == "VARCHAR" or col_type.startswith("ENUM"):
+        return f"CAST({col} AS VARCHAR)", ", ".join(values)
+    values = [f"CAST({v} AS {col_type})" for v in values]
+    # constants are only cast when a row is scanned; convert them up front
+    con.execute(f"SELECT {', '.join(values)}").fetchone()
+    return col, ", ".join(values)
+
+
+def _predicate(con, table_name: str, rule: dict) -> str | None:
+    """
+    Row-level violation condition, or None for aggregate-only rules.
+    NULLs only violate not_null.
+    """
+    col, p = _q(rule["column"]), rule["params"]
+    t = rule["rule_type"]
+    if t == "not_null":
+        return f"{col} IS NULL"
+    if t == "range":
+        parts = []
+        if p.get("min") is not None:
+            parts.append(f"{col} < {_lit(p['min'])}")
+        if p.get("max") is not None:
+            parts.append(f"{col} > {_lit(p['max'])}")
+        return " OR ".join(parts)
+    if t == "regex":
+        return f"{col} IS NOT NULL AND NOT regexp_matches(CAST({col} AS VARCHAR), {_lit(p['pattern'])})"
+    if t == "allowed_set":
+        target, values = _allowed_set(con, table_name, rule)
+        return f"{col} IS NOT NULL AND {target} NOT IN ({values})"
+    if t == "referential":
+        row = con.execute(
+            "SELECT table_name FROM dataset_versions WHERE version_id=?", [int(p["version_id"])]
+        ).fetchone()
+        if not row:
+            raise ValueError(f"Referential rule {rule['rule_id']}: unknown version_id={p['version_id']}")
+        ref = _q(p.get("column") or rule["column"])
+        return (
+            f"{col} IS NOT NULL AND CAST({col} AS VARCHAR) NOT IN "
+            f"(SELECT CAST({ref} AS VARCHAR) FROM {row[0]} WHERE {ref} IS NOT NULL)"
+        )
+    return None
+
+
+def _rule_exprs(con, table_name: str, rule: dict) -> list[str]:
+    """
+    [violation count, first offending values] for one rule.
+    """
+    col = _q(rule["column"])
+    t = rule["rule_type"]
+    if t == "unique":
+        return [f"COUNT({col}) - COUNT(DISTINCT {col})", "NULL"]
+    if t == "freshness":
+        days = int(rule["params"]["max_age_days"])
+        newest = f"CAST(MAX({col}) AS TIMESTAMP)"
+        return [
+            f"CASE WHEN {newest} IS NULL OR {newest} < now()::TIMESTAMP - INTERVAL ({days}) DAY THEN 1 ELSE 0 END",
+            f"[CAST(MAX({col}) AS VARCHAR)]",
+        ]
+    pred = _predicate(con, table_name, rule)
+    # arg_min(..., n) keeps only n values per rule, however many rows fail
+    return [
+        f"COUNT(*) FILTER (WHERE ({pred}))",
+        f"arg_min(CAST({col} AS VARCHAR), rowid, {SAMPLE_OFFENDERS}) FILTER (WHERE ({pred}))",
+    ]
+
+
+def compile_rules(con, table_name: str, rules: list[dict]) -> str:
+    """
+    One SELECT with two columns per rule: violation count, sample offenders.
+    """
+    exprs = ["COUNT(*)"]
+    for rule in rules:
+        exprs += _rule_exprs(con, table_name, rule)
+    return f"SELECT {', '.join(exprs)} FROM {table_name}"
+
+
+def _bind_error(con, table_name: str, rule: dict) -> str | None:
+    """
+    Why the rule can't run on this table (checked without scanning), or None.
+    """
+    try:
+        con.execute(f"{compile_rules(con, table_name, [rule])} LIMIT 0").fetchall()
+    except Exception as e:
+        return str(e).splitlines()[0]
+    return None
+
+
+# -----------------------------
+# Evaluate
+# -----------------------------
+def _evaluate(con, version_id: int, table_name: str, rules: list[dict]) -> dict:
+    columns = {
+        r[0].lower() for r in con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name=?", [table_name]
+        ).fetchall()
+    }
+    # a rule that can't run on this version is reported, not run
+    errors = {}
+    for r in rules:
+        if r["column"].lower() not in columns:
+            errors[r["rule_id"]] = "column not in this version"
+        else:
+            error = _bind_error(con, table_name, r)
+            if error:
+                errors[r["rule_id"]] = error
+    runnable = [r for r in rules if r["rule_id"] not in errors]
+
+    try:
+        row = con.execute(compile_rules(con, table_name, runnable)).fetchone()
+        values = {r["rule_id"]: row[1 + 2 * i: 3 + 2 * i] for i, r in enumerate(runnable)}
+        total = int(row[0])
+    except Exception:
+        # failed while scanning (e.g. a cast error on one value): one scan per
+        # rule so only the failing rule loses its result
+        total = int(con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0])
+        values = {}
+        for r in runnable:
+            try:
+                values[r["rule_id"]] = con.execute(compile_rules(con, table_name, [r])).fetchone()[1:]
+            except Exception as e:
+                errors[r["rule_id"]] = str(e).splitlines()[0]
+
+    results = [
+        {
+            "rule_id": r["rule_id"],
+            "rule_type": r["rule_type"],
+            "column": r["column"],
+            "params": r["params"],
+            "violations": None,
+            "violation_pct": None,
+            "passed": None,
+            "sample_offenders": [],
+            "error": errors[r["rule_id"]],
+        }
+        for r in rules if r["rule_id"] in errors
+    ]
+    for rule in runnable:
+        if rule["rule_id"] in errors:
+            continue
+        violations, sample = values[rule["rule_id"]]
+        violations = int(violations or 0)
+        results.append({
+            "rule_id": rule["rule_id"],
+            "rule_type": rule["rule_type"],
+            "column": rule["column"],
+            "params": rule["params"],
+            "violations": violations,
+            "violation_pct": (100.0 * violations / total) if total and rule["rule_type"] != "freshness" else None,
+            "passed": violations == 0,
+            "sample_offenders": list(sample) if sample else [],
+            "error": None,
+        })
+    results.sort(key=lambda r: r["rule_id"])
+    return {"version_id": version_id, "table": table_name, "rows": total, "results": results}
+
+
+def evaluate_version(dataset_id: int, version_id: int, refresh: bool = False) -> dict:
+    """
+    Evaluate the dataset's rules on one version (cached per rules fingerprint).
+    """
+    con = _conn()
+    try:
+        row = con.execute(
+            "SELECT table_name FROM dataset_versions WHERE dataset_id=? AND version_id=?",
+            [dataset_id, version_id],
+        ).fetchone()
+        if not row:
+            raise ValueError(f"Unknown version_id={version_id} for dataset {dataset_id}")
+        rules = _load_rules(con, dataset_id)
+        fingerprint = rules_fingerprint(rules)
+
+        if not refresh:
+            cached = con.execute(
+                "SELECT results_json FROM quality_results WHERE version_id=? AND rules_hash=?",
+                [version_id, fingerprint],
+            ).fetchone()
+            if cached:
+                return {**json.loads(cached[0]), "cached": True}
+
+        if rules:
+            out = _evaluate(con, version_id, row[0], rules)
+        else:
+            out = {"version_id": version_id, "table": row[0], "rows": None, "results": []}
+        con.execute(
+            "INSERT OR REPLACE INTO quality_results VALUES (?, ?, ?, ?)",
+            [version_id, fingerprint, json.dumps(out, default=str), datetime.utcnow()],
+        )
+        return {**out, "cached": False}
+    finally:
+        con.close()
+
+
+def evaluate_dataset(dataset_id: int) -> list[dict]:
+    """
+    Evaluate every version of a dataset; only versions without a result for
+    the current rules are scanned.
+    """
+    con = _conn()
+    version_ids = [
+        int(r[0]) for r in con.execute(
+            "SELECT version_id FROM dataset_versions WHERE dataset_id=? ORDER BY version_id", [dataset_id]
+        ).fetchall()
+    ]
+    con.close()
+    return [evaluate_version(dataset_id, vid) for vid in version_ids]
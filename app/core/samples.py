@@ -0,0 +1,126 @@
+"""
+Per-version sample store.
+
+Each version table gets a fixed sample (reservoir, or stratified by one
+column) written once as an uncompressed Arrow IPC file:
+
+    data/samples/<table_name>.arrow
+
+Readers memory-map the file, so previews, profiling, Quick Analysis and AI
+prompt context load without touching DuckDB. The mapped Arrow table is
+cached per process, but it is not zero-copy end to end: every load_sample()
+call copies the sample into a new pandas DataFrame (a few thousand rows), so
+callers can't mutate each other's data.
+Without pyarrow the sample is drawn from DuckDB on every call instead.
+"""
+import os
+
+import pandas as pd
+
+SAMPLE_DIR = os.path.join("data", "samples")
+DEFAULT_SAMPLE_ROWS = 5000
+SEED = 42
+
+_cache = {}  # path -> (mtime, pyarrow.Table)
+
+
+def sample_path(table_name: str) -> str:
+    return os.path.join(SAMPLE_DIR, f"{table_name}.arrow")
+
+
+def _sample_query(con, table_name: str, rows: int, stratify_by: str | None) -> str:
+    """
+    Sampled rows in table order (rowid), so a preview still reads top-down.
+    """
+    rows = int(rows)
+    if not stratify_by:
+        return (
+            f"SELECT * EXCLUDE (__rowid) FROM "
+            f"(SELECT *, rowid AS __rowid FROM {table_name} USING SAMPLE reservoir({rows} ROWS) REPEATABLE ({SEED})) "
+            f"ORDER BY __rowid"
+        )
+
+    # proportional per group, at least one row per group; rounding up (and
+    # more groups than rows) can overshoot, so keep the first `rows` by rank
+    # within group: every group's first row goes before any group's second
+    total = con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0] or 1
+    col = '"' + stratify_by.replace('"', '""') + '"'
+    return f"""
+        SELECT * EXCLUDE (__rowid, __rn, __n) FROM (
+            SELECT * FROM (
+                SELECT *, rowid AS __rowid,
+                       ROW_NUMBER() OVER (PARTITION BY {col} ORDER BY hash(rowid + {SEED})) AS __rn,
+                       COUNT(*) OVER (PARTITION BY {col}) AS __n
+                FROM {table_name}
+            )
+            WHERE __rn <= GREATEST(1, CEIL(__n * {rows} / {int(total)}))
+            QUALIFY ROW_NUMBER() OVER (ORDER BY __rn, hash(__rowid + {SEED}), __rowid) <= {rows}
+        )
+        ORDER BY __rowid
+    """
+
+
+def _arrow_table(cur):
+    # to_arrow_table() is the newer name for fetch_arrow_table()
+    return cur.to_arrow_table() if hasattr(cur, "to_arrow_table") else cur.fetch_arrow_table()
+
+
+def write_sample(con, table_name: str, rows: int = DEFAULT_SAMPLE_ROWS, stratify_by: str | None = None) -> str | None:
+    """
+    Draw the sample with an open connection and persist it.
+    Returns the file path, or None when pyarrow isn't installed.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    table = _arrow_table(con.execute(_sample_query(con, table_name, rows, stratify_by)))
+    os.makedirs(SAMPLE_DIR, exist_ok=True)
+    path = sample_path(table_name)
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        # uncompressed so the file can be memory-mapped as-is
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+    _cache.pop(path, None)
+    return path
+
+
+def build_sample(table_name: str, rows: int = DEFAULT_SAMPLE_ROWS, stratify_by: str | None = None) -> str | None:
+    from app.core.warehouse import _conn
+
+    con = _conn()
+    path = write_sample(con, table_name, rows=rows, stratify_by=stratify_by)
+    con.close()
+    return path
+
+
+def load_sample(table_name: str) -> pd.DataFrame:
+    """
+    The stored sample for a version as a new DataFrame (copied from the
+    cached Arrow table; built on first use for versions created before the
+    store existed).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        from app.core.warehouse import _conn
+
+        con = _conn()
+        df = con.execute(_sample_query(con, table_name, DEFAULT_SAMPLE_ROWS, None)).df()
+        con.close()
+        return df
+
+    path = sample_path(table_name)
+    if not os.path.exists(path):
+        build_sample(table_name)
+
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(path)
+    if not cached or cached[0] != mtime:
+        source = pa.memory_map(path, "r")
+        cached = (mtime, pa.ipc.open_file(source).read_all())
+        _cache[path] = cached
+    return cached[1].to_pandas()
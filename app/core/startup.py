@@ -0,0 +1,109 @@
+"""
+Startup / rerun timing.
+
+app.py calls start_run() first thing and mark("<phase>") after each
+phase; report() compares the run against its budget. A cold start (first
+run in the process) pays for imports and schema setup, so it gets a
+larger budget than a Streamlit rerun.
+
+import_report() profiles module imports with `python -X importtime` in a
+fresh interpreter (used by `python -m app.cli startup-report`).
+"""
+import importlib.util
+import subprocess
+import sys
+import time
+
+COLD_START_BUDGET_MS = 2000
+RERUN_BUDGET_MS = 300
+
+_state = {"runs": 0, "started": None, "last": None, "phases": []}
+
+
+def start_run():
+    now = time.perf_counter()
+    _state["runs"] += 1
+    _state["started"] = now
+    _state["last"] = now
+    _state["phases"] = []
+
+
+def mark(label: str):
+    if _state["started"] is None:
+        start_run()
+    now = time.perf_counter()
+    _state["phases"].append((label, (now - _state["last"]) * 1000.0))
+    _state["last"] = now
+
+
+def report() -> dict:
+    cold = _state["runs"] <= 1
+    budget = COLD_START_BUDGET_MS if cold else RERUN_BUDGET_MS
+    total = sum(ms for _, ms in _state["phases"])
+    return {
+        "run": "cold start" if cold else "rerun",
+        "phases_ms": {label: round(ms, 1) for label, ms in _state["phases"]},
+        "total_ms": round(total, 1),
+        "budget_ms": budget,
+        "over_budget": total > budget,
+    }
+
+
+def _importtime(code: str) -> list[dict]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else "import failed")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        indent = len(parts[2]) - len(parts[2].lstrip())
+        rows.append({
+            "module": parts[2].strip(),
+            "depth": (indent - 1) // 2,
+            "self_ms": int(parts[0]) / 1000.0,
+            "cumulative_ms": int(parts[1]) / 1000.0,
+        })
+    return rows
+
+
+def import_report(modules: list[str], top: int = 15) -> dict:
+    """
+    Cumulative import time per module for `import <modules>` in a fresh
+    interpreter, slowest first. Modules that aren't installed (e.g.
+    streamlit on a headless box) are skipped and listed.
+    """
+    skipped = [m for m in modules if importlib.util.find_spec(m.split(".")[0]) is None]
+    modules = [m for m in modules if m not in skipped]
+    if not modules:
+        raise RuntimeError(f"none of the modules are installed: {skipped}")
+
+    started = time.perf_counter()
+    rows = _importtime("; ".join(f"import {m}" for m in modules))
+    wall_ms = (time.perf_counter() - started) * 1000.0
+
+    # drop what the bare interpreter imports anyway
+    boot = {r["module"] for r in _importtime("pass")}
+    rows = [r for r in rows if r["module"] not in boot]
+
+    # top-level entries (depth 0) add up to the whole import cost
+    total = sum(r["cumulative_ms"] for r in rows if r["depth"] == 0)
+    return {
+        "modules": modules,
+        "skipped": skipped,
+        "import_ms": round(total, 1),
+        "interpreter_wall_ms": round(wall_ms, 1),
+        "budget_ms": COLD_START_BUDGET_MS,
+        "over_budget": total > COLD_START_BUDGET_MS,
+        "slowest": sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top],
+    }
@@ -2,15 +2,25 @@ import json
 import pandas as pd
 
 
-def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+def _normalize_name(c: str) -> str:
+    return c.strip().lower().replace(" ", "_")
+
+
+def normalize_columns(df: pd.DataFrame, column_map: dict | None = None) -> pd.DataFrame:
+    """
+    column_map (from plan_recipe) skips recomputing names for a known schema.
+    """
     df = df.copy()
-    df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
+    if column_map is None:
+        df.columns = [_normalize_name(c) for c in df.columns]
+    else:
+        df.columns = [column_map.get(c, _normalize_name(c)) for c in df.columns]
     return df
 
 
 def trim_strings(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
-    for c in df.select_dtypes(include=["object"]).columns:
+    for c in df.select_dtypes(include=["object", "category"]).columns:
         df[c] = df[c].astype(str).str.strip()
     return df
 
@@ -19,23 +29,91 @@ def drop_duplicate_rows(df: pd.DataFrame) -> pd.DataFrame:
     return df.drop_duplicates().copy()
 
 
-def parse_dates_best_effort(df: pd.DataFrame, sample_n: int = 200) -> pd.DataFrame:
+def _guess_format(value) -> str | None:
+    try:
+        from pandas.tseries.api import guess_datetime_format
+    except ImportError:  # older pandas
+        from pandas._libs.tslibs.parsing import guess_datetime_format
+    try:
+        return guess_datetime_format(str(value))
+    except Exception:
+        return None
+
+
+def detect_date_formats(df: pd.DataFrame, sample_n: int = 200) -> dict:
+    """
+    {column: strftime format or None} for columns parse_dates_best_effort
+    would convert. None means "let pandas infer".
+    """
+    formats = {}
+    for c in df.columns:
+        name = str(c).lower()
+        if ("date" not in name) and ("time" not in name):
+            continue
+        sample = df[c].head(sample_n)
+        try:
+            if pd.to_datetime(sample, errors="coerce").notna().mean() < 0.5:
+                continue
+        except Exception:
+            continue
+        first = sample.dropna()
+        if first.empty or pd.api.types.is_datetime64_any_dtype(sample):
+            formats[c] = None
+        else:
+            formats[c] = _guess_format(first.iloc[0])
+    return formats
+
+
+def _looks_like_date(c) -> bool:
+    name = str(c).lower()
+    return ("date" in name) or ("time" in name)
+
+
+def _parse_inferred(df: pd.DataFrame, c, sample_n: int):
+    try:
+        sample = df[c].head(sample_n)
+        parsed = pd.to_datetime(sample, errors="coerce")
+        # only convert if at least 50% sample parses
+        if parsed.notna().mean() >= 0.5:
+            df[c] = pd.to_datetime(df[c], errors="coerce")
+    except Exception:
+        pass
+
+
+def _parse_with_formats(df: pd.DataFrame, formats: dict, sample_n: int) -> pd.DataFrame:
+    for c, fmt in formats.items():
+        if c not in df.columns:
+            continue
+        sample = df[c].head(sample_n)
+        try:
+            # a known format is only trusted if it still fits this file
+            if fmt and pd.to_datetime(sample, format=fmt, errors="coerce").notna().mean() >= 0.5:
+                df[c] = pd.to_datetime(df[c], format=fmt, errors="coerce")
+            elif pd.to_datetime(sample, errors="coerce").notna().mean() >= 0.5:
+                df[c] = pd.to_datetime(df[c], errors="coerce")
+        except Exception:
+            pass
+    # date-like columns the plan skipped (their sample didn't parse in the
+    # planning file) get the same detection as without a plan
+    for c in df.columns:
+        if c not in formats and _looks_like_date(c):
+            _parse_inferred(df, c, sample_n)
+    return df
+
+
+def parse_dates_best_effort(df: pd.DataFrame, sample_n: int = 200, formats: dict | None = None) -> pd.DataFrame:
     """
     Parse columns that look like date/time. Uses a small sample to avoid
     converting every column and slowing down big data.
+    formats (from plan_recipe) gives a fixed format for the planned columns;
+    other date-like columns are still detected.
     """
     df = df.copy()
+    if formats is not None:
+        return _parse_with_formats(df, formats, sample_n)
     for c in df.columns:
-        name = str(c).lower()
-        if ("date" in name) or ("time" in name):
-            try:
-                sample = df[c].head(sample_n)
-                parsed = pd.to_datetime(sample, errors="coerce")
-                # only convert if at least 50% sample parses
-                if parsed.notna().mean() >= 0.5:
-                    df[c] = pd.to_datetime(df[c], errors="coerce")
-            except Exception:
-                pass
+        if _looks_like_date(c):
+            _parse_inferred(df, c, sample_n)
     return df
 
 
@@ -93,11 +171,43 @@ OPS = {
 }
 
 
-def apply_recipe(df: pd.DataFrame, recipe: list) -> pd.DataFrame:
+# op -> keyword argument that takes the precomputed plan entry
+PLAN_ARGS = {
+    "normalize_columns": "column_map",
+    "parse_dates_best_effort": "formats",
+}
+
+
+def _plan_kwargs(op: str, plan: dict | None) -> dict:
+    arg = PLAN_ARGS.get(op)
+    if plan and arg in plan:
+        return {arg: plan[arg]}
+    return {}
+
+
+def plan_recipe(sample: pd.DataFrame, recipe: list) -> dict:
+    """
+    Do the schema-level work of a recipe once (column renames, date formats)
+    by running it over a small sample. Pass the result to apply_recipe for
+    every frame with the same columns.
+    """
+    plan = {}
+    out = sample.copy()
+    for step in recipe:
+        op = step["op"]
+        if op == "normalize_columns":
+            plan["column_map"] = {c: _normalize_name(c) for c in out.columns}
+        elif op == "parse_dates_best_effort":
+            plan["formats"] = detect_date_formats(out)
+        out = OPS[op](out, **_plan_kwargs(op, plan))
+    return plan
+
+
+def apply_recipe(df: pd.DataFrame, recipe: list, plan: dict | None = None) -> pd.DataFrame:
     out = df.copy()
     for step in recipe:
         op = step["op"]
-        out = OPS[op](out)
+        out = OPS[op](out, **_plan_kwargs(op, plan))
     return out
 
 
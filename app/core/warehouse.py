@@ -4,16 +4,44 @@ import duckdb
 import pandas as pd
 from datetime import datetime
 
+from app.core.cubes import build_cubes, rewrite_query, record_error
+from app.core.optimize import optimize_dtypes
+from app.core.profiling import column_stats
+from app.core.samples import write_sample
+
 DB_PATH = os.path.join("data", "workspace.duckdb")
 
+# Bump when init_db() gains a table/column so existing workspaces re-run the DDL.
+SCHEMA_VERSION = 2
+_schema_ready = {}  # DB_PATH -> True once checked in this process
+
 
 def _conn():
     os.makedirs("data", exist_ok=True)
     return duckdb.connect(DB_PATH)
 
 
+def _schema_version(con) -> int | None:
+    try:
+        row = con.execute("SELECT version FROM schema_meta").fetchone()
+    except duckdb.CatalogException:
+        return None
+    return int(row[0]) if row else None
+
+
 def init_db():
+    """
+    Create the warehouse tables. Runs the DDL only when the stored schema
+    version is behind SCHEMA_VERSION, and checks at most once per process
+    (Streamlit reruns call this on every interaction).
+    """
+    if _schema_ready.get(DB_PATH):
+        return
     con = _conn()
+    if _schema_version(con) == SCHEMA_VERSION:
+        con.close()
+        _schema_ready[DB_PATH] = True
+        return
 
     # Datasets + versions
     con.execute("""
@@ -36,6 +64,95 @@ def init_db():
     );
     """)
 
+    # Physical storage info per version (types + memory saved on ingest)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS version_metadata (
+        version_id BIGINT PRIMARY KEY,
+        physical_types_json TEXT,
+        memory_before_bytes BIGINT,
+        memory_after_bytes BIGINT,
+        created_at TIMESTAMP
+    );
+    """)
+
+    # Per-column stats per version (one scan at creation; used by diffs)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS version_column_stats (
+        version_id BIGINT NOT NULL,
+        column_name TEXT NOT NULL,
+        data_type TEXT,
+        row_count BIGINT,
+        null_count BIGINT,
+        distinct_approx BIGINT,
+        min_value TEXT,
+        max_value TEXT,
+        mean DOUBLE,
+        PRIMARY KEY(version_id, column_name)
+    );
+    """)
+
+    # Cached version-to-version diffs (see app/core/diff.py)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS version_diffs (
+        version_a BIGINT NOT NULL,
+        version_b BIGINT NOT NULL,
+        key_json TEXT NOT NULL,
+        summary_json TEXT NOT NULL,
+        created_at TIMESTAMP,
+        PRIMARY KEY(version_a, version_b, key_json)
+    );
+    """)
+
+    # Declarative quality rules per dataset + cached results per version (see app/core/quality_rules.py)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS quality_rules (
+        rule_id BIGINT PRIMARY KEY,
+        dataset_id BIGINT NOT NULL,
+        rule_type TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        params_json TEXT,
+        created_at TIMESTAMP
+    );
+    """)
+
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS quality_results (
+        version_id BIGINT NOT NULL,
+        rules_hash TEXT NOT NULL,
+        results_json TEXT NOT NULL,
+        created_at TIMESTAMP,
+        PRIMARY KEY(version_id, rules_hash)
+    );
+    """)
+
+    # Pre-built rollups per version (see app/core/cubes.py)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS aggregate_cubes (
+        table_name TEXT NOT NULL,
+        group_key TEXT NOT NULL,
+        cube_table TEXT NOT NULL,
+        measures_json TEXT,
+        created_at TIMESTAMP,
+        PRIMARY KEY(table_name, group_key)
+    );
+    """)
+
+    # AI chat: question -> validated SQL, reused for paraphrases (see app/agent/sql_cache.py)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS nl_sql_cache (
+        entry_id BIGINT PRIMARY KEY,
+        schema_key TEXT NOT NULL,
+        question TEXT NOT NULL,
+        embedding_json TEXT NOT NULL,
+        sql_template TEXT NOT NULL,
+        answer TEXT,
+        chart_json TEXT,
+        hits BIGINT,
+        created_at TIMESTAMP,
+        last_used_at TIMESTAMP
+    );
+    """)
+
     # Projects (objective/workspace)
     con.execute("""
     CREATE TABLE IF NOT EXISTS projects (
@@ -74,7 +191,19 @@ def init_db():
     );
     """)
 
+    con.execute("CREATE TABLE IF NOT EXISTS schema_meta (version INTEGER)")
+    con.execute("DELETE FROM schema_meta")
+    con.execute("INSERT INTO schema_meta VALUES (?)", [SCHEMA_VERSION])
     con.close()
+    _schema_ready[DB_PATH] = True
+
+
+def reset_schema_check():
+    """
+    Make the next init_db() re-check the stored schema version, as a fresh
+    process would.
+    """
+    _schema_ready.pop(DB_PATH, None)
 
 
 def _new_id(con, table: str, col: str) -> int:
@@ -93,6 +222,23 @@ def register_new_dataset(name: str) -> int:
     return dataset_id
 
 
+def create_dataset_from_df(name: str, df: pd.DataFrame, source_filename: str, recipe_json: str) -> tuple:
+    """
+    Register a dataset and store df as its first version. If the version
+    can't be created the dataset row is removed again, so no version-less
+    dataset is left behind. Returns (dataset_id, version_id).
+    """
+    dataset_id = register_new_dataset(name=name)
+    try:
+        version_id = create_version_from_df(dataset_id, df, source_filename=source_filename, recipe_json=recipe_json)
+    except Exception:
+        con = _conn()
+        con.execute("DELETE FROM datasets WHERE dataset_id=?", [dataset_id])
+        con.close()
+        raise
+    return dataset_id, version_id
+
+
 def list_datasets() -> pd.DataFrame:
     con = _conn()
     df = con.execute("SELECT * FROM datasets ORDER BY created_at DESC").df()
@@ -100,23 +246,85 @@ def list_datasets() -> pd.DataFrame:
     return df
 
 
-def create_version_from_df(dataset_id: int, df: pd.DataFrame, source_filename: str, recipe_json: str) -> int:
+def create_version_from_df(
+    dataset_id: int, df: pd.DataFrame, source_filename: str, recipe_json: str, optimize: bool = True
+) -> int:
+    """
+    Store df as a new version table. With optimize=True, low-cardinality
+    text becomes ENUM (see optimize_dtypes).
+    """
+    if optimize:
+        df, info = optimize_dtypes(df)
+        before, after = info["memory_before_bytes"], info["memory_after_bytes"]
+    else:
+        before = after = int(df.memory_usage(deep=True).sum())
+
     con = _conn()
-    version_id = _new_id(con, "dataset_versions", "version_id")
+    # all-or-nothing: a failure below must not leave a half-built version registered
+    con.execute("BEGIN TRANSACTION")
+    try:
+        version_id = _new_id(con, "dataset_versions", "version_id")
+
+        # table name unique per version
+        safe_id = str(dataset_id).replace("-", "_")
+        table_name = f"ds_{safe_id}_v_{version_id}"
+
+        con.register("tmp_df", df)
+        con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM tmp_df")
+
+        con.execute(
+            "INSERT INTO dataset_versions VALUES (?, ?, ?, ?, ?, ?)",
+            [version_id, dataset_id, table_name, source_filename, recipe_json, datetime.utcnow()],
+        )
+
+        types = con.execute(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name=? ORDER BY ordinal_position",
+            [table_name],
+        ).fetchall()
+        con.execute(
+            "INSERT INTO version_metadata VALUES (?, ?, ?, ?, ?)",
+            [version_id, json.dumps(dict(types)), before, after, datetime.utcnow()],
+        )
+        stats = column_stats(con, table_name)
+        save_column_stats(con, version_id, stats)
+        build_cubes(con, table_name, distinct={s["column"]: s["distinct_approx"] for s in stats})
+        write_sample(con, table_name)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    return version_id
 
-    # table name unique per version
-    safe_id = str(dataset_id).replace("-", "_")
-    table_name = f"ds_{safe_id}_v_{version_id}"
 
-    con.register("tmp_df", df)
-    con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM tmp_df")
+def save_column_stats(con, version_id: int, stats: list[dict]):
+    con.execute("DELETE FROM version_column_stats WHERE version_id=?", [version_id])
+    if stats:
+        con.executemany(
+            "INSERT INTO version_column_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                [version_id, s["column"], s["data_type"], s["row_count"], s["null_count"],
+                 s["distinct_approx"], s["min"], s["max"], s["mean"]]
+                for s in stats
+            ],
+        )
 
-    con.execute(
-        "INSERT INTO dataset_versions VALUES (?, ?, ?, ?, ?, ?)",
-        [version_id, dataset_id, table_name, source_filename, recipe_json, datetime.utcnow()],
-    )
+
+def get_version_metadata(version_id: int) -> dict | None:
+    con = _conn()
+    row = con.execute(
+        "SELECT physical_types_json, memory_before_bytes, memory_after_bytes FROM version_metadata WHERE version_id=?",
+        [version_id],
+    ).fetchone()
     con.close()
-    return version_id
+    if not row:
+        return None
+    return {
+        "physical_types": json.loads(row[0]) if row[0] else {},
+        "memory_before_bytes": row[1],
+        "memory_after_bytes": row[2],
+    }
 
 
 def get_active_table(dataset_id: int) -> str:
@@ -165,12 +373,36 @@ def set_active_version(dataset_id: int, version_id: int) -> str:
     return row[0] if row else None
 
 
-def sql(query: str, params=None) -> pd.DataFrame:
+def _run_rewritten(query: str, wrap, fetch):
+    """
+    Run wrap(query) with the query itself served from a cube when one
+    matches (see app/core/cubes.py); falls back to the base table if the
+    rewritten SQL fails.
+    """
     con = _conn()
+    try:
+        base = query.strip().rstrip(";")
+        rewritten = rewrite_query(con, base)
+        try:
+            return fetch(con.execute(wrap(rewritten or base)))
+        except Exception:
+            if not rewritten:
+                raise
+            record_error()
+            return fetch(con.execute(wrap(base)))
+    finally:
+        con.close()
+
+
+def sql(query: str, params=None) -> pd.DataFrame:
+    """
+    Run a query. Simple GROUP BY aggregates on a version table are answered
+    from its pre-built cube when one matches (see app/core/cubes.py).
+    """
     if params is None:
-        df = con.execute(query).df()
-    else:
-        df = con.execute(query, params).df()
+        return _run_rewritten(query, lambda q: q, lambda cur: cur.df())
+    con = _conn()
+    df = con.execute(query, params).df()
     con.close()
     return df
 
@@ -183,3 +415,98 @@ def sql_scalar(query: str, params=None):
         val = con.execute(query, params).fetchone()
     con.close()
     return val[0] if val else None
+
+
+EXPORT_FORMATS = {".csv": "(FORMAT CSV, HEADER)", ".parquet": "(FORMAT PARQUET)", ".xlsx": None}
+XLSX_MAX_ROWS = 1_048_575  # Excel sheet limit minus the header row
+
+
+def iter_batches(query: str, params=None, batch_size: int = 100_000):
+    """
+    Yield the result as pyarrow RecordBatches of up to batch_size rows.
+    Only one batch is held in Python at a time.
+    """
+    con = _conn()
+    try:
+        cur = con.execute(query) if params is None else con.execute(query, params)
+        # to_arrow_reader() is the newer name for fetch_record_batch()
+        reader = cur.to_arrow_reader(batch_size) if hasattr(cur, "to_arrow_reader") else cur.fetch_record_batch(batch_size)
+        for batch in reader:
+            yield batch
+    finally:
+        con.close()
+
+
+def sql_page(query: str, page: int, page_size: int = 500) -> pd.DataFrame:
+    """
+    One page of a query's result (page is 0-based). LIMIT/OFFSET is pushed
+    into DuckDB, so only page_size rows are materialized.
+    """
+    offset = max(int(page), 0) * int(page_size)
+    return _run_rewritten(
+        query,
+        lambda q: f"SELECT * FROM ({q}) AS page_q LIMIT {int(page_size)} OFFSET {offset}",
+        lambda cur: cur.df(),
+    )
+
+
+def count_rows(query: str) -> int:
+    return int(_run_rewritten(query, lambda q: f"SELECT COUNT(*) FROM ({q}) AS count_q", lambda cur: cur.fetchone()[0]))
+
+
+def table_columns(table_name: str) -> list[tuple]:
+    """
+    [(column_name, data_type), ...] without reading any rows.
+    """
+    con = _conn()
+    cols = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name=? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    con.close()
+    return cols
+
+
+def _export_xlsx(query: str, path: str):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("data")
+    rows = 0
+    header_written = False
+    for batch in iter_batches(query, batch_size=50_000):
+        if not header_written:
+            ws.append(batch.schema.names)
+            header_written = True
+        rows += batch.num_rows
+        if rows > XLSX_MAX_ROWS:
+            raise ValueError(f"XLSX holds at most {XLSX_MAX_ROWS:,} rows; use CSV or Parquet instead.")
+        for row in zip(*(col.to_pylist() for col in batch.columns)):
+            ws.append(list(row))
+    wb.save(path)
+
+
+def export_query(query: str, path: str) -> str:
+    """
+    Write a query result to .csv/.parquet/.xlsx without building a DataFrame.
+    CSV and Parquet use DuckDB's COPY ... TO; XLSX streams Arrow batches
+    into a write-only openpyxl workbook.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {ext or path}")
+
+    base = query.strip().rstrip(";")
+    if ext == ".xlsx":
+        _export_xlsx(base, path)
+        return path
+
+    target = path.replace("'", "''")
+    con = _conn()
+    con.execute(f"COPY ({base}) TO '{target}' {EXPORT_FORMATS[ext]}")
+    con.close()
+    return path
+
+
+def export_table(table_name: str, path: str) -> str:
+    return export_query(f"SELECT * FROM {table_name}", path)